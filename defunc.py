@@ -11,20 +11,35 @@ telegram-parser-v2.2
 """
 
 import os
+import sys
 import time
+import asyncio
 import random
+import math
+import hashlib
+import heapq
+import itertools
 import re
+import atexit
+import contextlib
+import dataclasses
 import logging
+import logging.handlers
+import queue
 import sqlite3
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
-from typing import Iterable, List, Optional, Tuple, Union, Dict, Any
+from typing import Iterable, Iterator, List, Optional, Tuple, Union, Dict, Any, Deque
 
 from telethon.sync import TelegramClient
 from telethon import utils as tl_utils
+from telethon import helpers as tl_helpers
 from telethon.tl.functions.channels import InviteToChannelRequest, JoinChannelRequest, GetParticipantRequest
 from telethon.tl.types import (
     InputPeerUser,
+    User,
     UserStatusOnline,
     UserStatusRecently,
     UserStatusLastWeek,
@@ -42,6 +57,7 @@ from telethon.errors import (
     UserIdInvalidError,
     UserNotParticipantError,
     RPCError,
+    UnauthorizedError,
 )
 
 # Extra RPC errors used to classify preflight issues more precisely
@@ -103,6 +119,13 @@ def _diagnose_invite_context(client: TelegramClient, target_entity: Any) -> Dict
     except Exception:
         pass
 
+    # инвайт работает с InputPeer; заголовок и default_banned_rights есть только у полного объекта
+    if not hasattr(target_entity, "title"):
+        try:
+            target_entity = client.get_entity(target_entity)
+        except Exception:
+            pass
+
     try:
         out["target"] = _target_brief(target_entity)
     except Exception:
@@ -179,50 +202,103 @@ def session_name_from_file(session_file: str) -> str:
     return os.path.join(SESSIONS_DIR, name)
 
 
-def list_session_files() -> List[str]:
-    """Возвращает список файлов *.session (ТОЛЬКО имена файлов) из папки sessoins."""
-    ensure_sessions_dir()
-    p = Path(SESSIONS_DIR)
-    return sorted([x.name for x in p.glob("*.session") if x.is_file()])
+# список .session: папку перечитываем только когда у неё сменился mtime (добавили/удалили файл)
+_sess_cache: Dict[str, Any] = {"mtime": None, "val": ()}
 
 
 def list_session_files() -> List[str]:
     """Возвращает список файлов .session (только имена файлов, без пути)."""
     ensure_sessions_dir()
-    out: List[str] = []
     try:
-        for p in Path(SESSIONS_DIR).glob("*.session"):
-            out.append(p.name)
-    except Exception:
-        pass
-    return sorted(out)
+        mtime = os.stat(SESSIONS_DIR).st_mtime_ns
+    except OSError:
+        return []
+    if mtime == _sess_cache["mtime"]:
+        return list(_sess_cache["val"])
+    # scandir: тип файла приходит из readdir, без отдельного stat на каждую запись
+    try:
+        with os.scandir(SESSIONS_DIR) as it:
+            lst = sorted(e.name for e in it if e.name.endswith(".session") and e.is_file())
+    except OSError:
+        return []
+    _sess_cache["mtime"] = mtime
+    _sess_cache["val"] = tuple(lst)
+    return lst
 
 # -------------------- ЛОГИ --------------------
 
+# Пишем app.log в фоне: рабочий поток только кладёт запись в очередь (QueueHandler),
+# поток QueueListener отдаёт её в MemoryHandler, который пишет файл пачками до 64 записей
+# (ВНИМАНИЕ/СТОП сбрасывают буфер сразу).
+_log_buffer: Optional[logging.handlers.MemoryHandler] = None
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+# INVITER_VERBOSE=0 — циклы инвайта не пишут построчные УСПЕХ/ИНФО на каждого пользователя
+# (записи не формируются вовсе); итоги, парсинг, preflight, ВНИМАНИЕ/СТОП — как обычно
+LOG_VERBOSE = os.environ.get("INVITER_VERBOSE", "1") != "0"
+
 def _setup_logging() -> None:
-    logging.basicConfig(
-        filename=LOG_FILE,
-        level=logging.INFO,
-        format="%(asctime)s | %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    global _log_buffer, _log_listener
+    fh = logging.FileHandler(LOG_FILE, encoding="utf-8", delay=True)
+    fh.setFormatter(logging.Formatter("%(asctime)s | %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+    _log_buffer = logging.handlers.MemoryHandler(capacity=64, flushLevel=logging.WARNING, target=fh)
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, _log_buffer)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_listener.start()
+    atexit.register(_log_shutdown)
+
+def log_flush() -> None:
+    """Дописывает очередь и буфер логов в app.log (конец операции)."""
+    if _log_listener is None or _log_buffer is None:
+        return
+    # stop() дожидается, пока фоновый поток разберёт очередь; затем пишем буфер и запускаем поток снова
+    _log_listener.stop()
+    _log_buffer.flush()
+    _log_listener.start()
+
+@contextlib.contextmanager
+def log_batch():
+    """Копит записи (включая ВНИМАНИЕ) в буфере и пишет их в app.log одним сбросом в конце.
+
+    Годится и как декоратор: @log_batch().
+    """
+    if _log_buffer is None:
+        yield
+        return
+    level = _log_buffer.flushLevel
+    # выше CRITICAL: буфер сбрасывается только по заполнению (64 записи) и в конце пачки
+    _log_buffer.flushLevel = logging.CRITICAL + 1
+    try:
+        yield
+    finally:
+        log_flush()
+        _log_buffer.flushLevel = level
+
+def _log_shutdown() -> None:
+    if _log_listener is not None:
+        _log_listener.stop()
+    if _log_buffer is not None:
+        _log_buffer.flush()
 
 _setup_logging()
 
-def log_info(msg: str) -> None:
-    logging.info(f"ИНФО | {msg}")
+def log_info(msg: str, *args: Any) -> None:
+    logging.info("ИНФО | " + msg, *args)
 
-def log_ok(msg: str) -> None:
-    logging.info(f"УСПЕХ | {msg}")
+def log_ok(msg: str, *args: Any) -> None:
+    logging.info("УСПЕХ | " + msg, *args)
 
-def log_warn(msg: str) -> None:
-    logging.info(f"ВНИМАНИЕ | {msg}")
+def log_warn(msg: str, *args: Any) -> None:
+    logging.warning("ВНИМАНИЕ | " + msg, *args)
 
-def log_pause(msg: str) -> None:
-    logging.info(f"ПАУЗА | {msg}")
+def log_pause(msg: str, *args: Any) -> None:
+    logging.info("ПАУЗА | " + msg, *args)
 
-def log_stop(msg: str) -> None:
-    logging.info(f"СТОП | {msg}")
+def log_stop(msg: str, *args: Any) -> None:
+    logging.warning("СТОП | " + msg, *args)
 
 # -------------------- OPTIONS --------------------
 
@@ -246,33 +322,109 @@ def ensure_options() -> None:
             f.seek(0)
             f.writelines(DEFAULT_OPTIONS)
 
-def getoptions() -> List[str]:
-    ensure_options()
-    with open("options.txt", "r", encoding="utf-8") as f:
-        return f.readlines()
+@dataclass
+class Options:
+    """options.txt в разобранном виде: 4 строки — api_id, api_hash, парсить user-id, парсить user-name."""
+    api_id: Optional[int] = None
+    api_hash: str = ""
+    parse_id: bool = True
+    parse_name: bool = True
+
+    @property
+    def has_api(self) -> bool:
+        return self.api_id is not None and bool(self.api_hash)
+
+    @classmethod
+    def from_lines(cls, lines: List[str]) -> "Options":
+        vals = [s.strip() for s in lines[:4]]
+        vals += [d.strip() for d in DEFAULT_OPTIONS[len(vals):]]
+        raw_id, raw_hash, raw_pid, raw_pname = vals
+        return cls(
+            api_id=int(raw_id) if raw_id.isdigit() else None,
+            api_hash="" if raw_hash == "NONEHASH" else raw_hash,
+            parse_id=raw_pid == "True",
+            parse_name=raw_pname == "True",
+        )
+
+    def to_lines(self) -> List[str]:
+        """Строки для options.txt (тот же формат, что и DEFAULT_OPTIONS)."""
+        return [
+            f"{'NONEID' if self.api_id is None else self.api_id}\n",
+            f"{self.api_hash or 'NONEHASH'}\n",
+            f"{self.parse_id}\n",
+            f"{self.parse_name}\n",
+        ]
+
+
+# разобранный options.txt: перечитываем только когда у файла сменились mtime/размер
+_opts_cache: Dict[str, Any] = {"mtime": None, "val": None}
+
+def getoptions() -> Options:
+    try:
+        st = os.stat("options.txt")
+    except FileNotFoundError:
+        st = None
+    if st is not None and st.st_size and (st.st_mtime_ns, st.st_size) == _opts_cache["mtime"]:
+        # копия: config() правит настройки на месте
+        return dataclasses.replace(_opts_cache["val"])
+
+    # одно чтение файла; ensure_options (ещё одно чтение) — только если файла нет или он пустой
+    try:
+        with open("options.txt", "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        lines = []
+    if not lines:
+        ensure_options()
+        lines = list(DEFAULT_OPTIONS)
+    opts = Options.from_lines(lines)
+    st = os.stat("options.txt")
+    _opts_cache["mtime"] = (st.st_mtime_ns, st.st_size)
+    _opts_cache["val"] = dataclasses.replace(opts)
+    return opts
+
+def saveoptions(options: Options) -> None:
+    """Записать options.txt атомарно: временный файл + fsync + os.replace (без «рваного» файла при сбое)."""
+    tmp = "options.txt.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(options.to_lines())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, "options.txt")
+    _opts_cache["mtime"] = None
 
 # -------------------- QUALITY FILTER (HARD) --------------------
 
-def _is_active(status) -> bool:
-    """Жёстко считаем активным: online/recently/last week или offline был в последние 7 дней."""
+# статусы, которые жёсткий фильтр всегда считает активными (проверка type(...) in — без обхода MRO)
+_ACTIVE_STATUS_TYPES = frozenset((UserStatusOnline, UserStatusRecently, UserStatusLastWeek))
+# offline считается активным, если был в сети не раньше чем столько назад
+_ACTIVE_WINDOW = timedelta(days=7)
+
+def _is_active(status, week_ago: Optional[datetime] = None) -> bool:
+    """Жёстко считаем активным: online/recently/last week или offline был в последние 7 дней.
+
+    `week_ago` (UTC, now - 7 дней) считает вызывающий цикл один раз на весь прогон.
+    """
     if status is None:
         return False
-    if isinstance(status, (UserStatusOnline, UserStatusRecently, UserStatusLastWeek)):
+    st_type = type(status)
+    if st_type in _ACTIVE_STATUS_TYPES:
         return True
-    if isinstance(status, UserStatusOffline):
+    if st_type is UserStatusOffline:
         try:
             # was_online обычно tz-aware (UTC)
             was = status.was_online
             if was is None:
                 return False
-            now = datetime.now(timezone.utc)
-            return (now - was) <= timedelta(days=7)
+            if week_ago is None:
+                week_ago = datetime.now(timezone.utc) - _ACTIVE_WINDOW
+            return was >= week_ago
         except Exception:
             return False
     # LastMonth считаем уже слабым для жёсткого фильтра
     return False
 
-def quality_hard(user) -> Tuple[bool, str]:
+def quality_hard(user, now: Optional[datetime] = None, week_ago: Optional[datetime] = None) -> Tuple[bool, str]:
     """
     Жёсткий фильтр качества (язык НЕ учитываем):
     - не бот
@@ -282,41 +434,87 @@ def quality_hard(user) -> Tuple[bool, str]:
     - есть фото
     - активен (online/recently/last week или был онлайн <=7 дней)
     """
-    if getattr(user, "bot", False):
+    # У telethon User все поля есть всегда — читаем напрямую, без getattr.
+    # Каналы/чаты (автор сообщения от имени канала) человеком не считаем.
+    if type(user) is not User:
+        return False, "не пользователь"
+    # быстрый путь для прошедших: одно составное условие, активность online/recently/last week — без вызова.
+    # Битовой маской по user.flags не проверить: Telethon раскладывает flags в bool-поля и само число не хранит.
+    status = user.status
+    if week_ago is None and now is not None:
+        week_ago = now - _ACTIVE_WINDOW
+    if (
+        not (user.bot or user.deleted or user.scam or user.fake)
+        and user.username
+        and user.photo
+        and (type(status) in _ACTIVE_STATUS_TYPES or _is_active(status, week_ago))
+    ):
+        return True, "ok"
+    # отказ — разбираем причину по порядку
+    if user.bot:
         return False, "бот"
-    if getattr(user, "deleted", False):
+    if user.deleted:
         return False, "удалён"
-    if getattr(user, "scam", False):
+    if user.scam:
         return False, "scam"
-    if getattr(user, "fake", False):
+    if user.fake:
         return False, "fake"
-    if not getattr(user, "username", None):
+    if not user.username:
         return False, "нет username"
-    if not getattr(user, "photo", None):
+    if not user.photo:
         return False, "нет фото"
-    if not _is_active(getattr(user, "status", None)):
-        return False, "не активен"
-    return True, "ok"
+    return False, "не активен"
+
+
+def quality_hard_batch(users: Iterable[Any], now: Optional[datetime] = None) -> List[Tuple[bool, str]]:
+    """quality_hard для пачки пользователей (страница iter_participants) с одним `now` на пачку."""
+    if now is None:
+        now = datetime.now(timezone.utc)
+    week_ago = now - _ACTIVE_WINDOW
+    return [quality_hard(u, now, week_ago) for u in users]
 
 # -------------------- DEDUP HELPERS --------------------
 
 def _read_set(path: str, strip_at: bool = False) -> set:
     if not os.path.exists(path):
         return set()
-    with open(path, "r", encoding="utf-8") as f:
-        items = set()
-        for line in f:
-            s = line.strip()
-            if not s:
-                continue
-            if strip_at and s.startswith("@"):
-                s = s[1:]
-            items.add(s)
-        return items
-
-def _append_unique(path: str, values: Iterable[str], prefix_at: bool = False) -> int:
-    existing = _read_set(path, strip_at=prefix_at)
-    new_vals = []
+    # один read + decode и splitlines() на C: без построчного TextIOWrapper;
+    # strip() — по строке, как раньше (пробел внутри строки её не делит)
+    with open(path, "rb") as f:
+        items = [s for s in map(str.strip, f.read().decode("utf-8").splitlines()) if s]
+    if not strip_at:
+        return set(items)
+    return {(s[1:] if s[0] == "@" else s) for s in items}
+
+# содержимое usernames.txt/userids.txt между вызовами парсинга: path -> ((mtime_ns, size), set)
+_known_cache: Dict[str, Tuple[Optional[Tuple[int, int]], set]] = {}
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _known_set(path: str, strip_at: bool = False) -> set:
+    """Множество значений файла из кеша процесса; перечитываем, только если файл менялся снаружи."""
+    stamp = _file_stamp(path)
+    cached = _known_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    vals = _read_set(path, strip_at=strip_at)
+    _known_cache[path] = (stamp, vals)
+    return vals
+
+def _append_unique(path: str, values: Iterable[str], prefix_at: bool = False, existing: Optional[set] = None) -> int:
+    """Дописать в path новые значения.
+
+    По умолчанию сверяемся с кешем процесса (_known_set): файл читается один раз, дальше — только дозапись.
+    Переданный `existing` пополняется на месте.
+    """
+    if existing is None:
+        existing = _known_set(path, strip_at=prefix_at)
+    new_vals: List[str] = []
     for v in values:
         if not v:
             continue
@@ -324,25 +522,103 @@ def _append_unique(path: str, values: Iterable[str], prefix_at: bool = False) ->
         if not vv:
             continue
         # нормализация
-        if prefix_at and vv.startswith("@"):
+        if prefix_at and vv[0] == "@":
             vv = vv[1:]
         if vv in existing:
             continue
         existing.add(vv)
-        new_vals.append(("@" + vv) if prefix_at else vv)
+        new_vals.append(vv)
 
     if not new_vals:
         return 0
 
-    with open(path, "a", encoding="utf-8") as f:
-        for v in new_vals:
-            f.write(v + "\n")
+    # один encode и один write вместо построчного TextIOWrapper
+    prefix = "@" if prefix_at else ""
+    blob = (prefix + ("\n" + prefix).join(new_vals) + "\n").encode("utf-8")
+    with open(path, "ab") as f:
+        f.write(blob)
+    if _known_cache.get(path, (None, None))[1] is existing:
+        # свою дозапись кешу засчитываем сразу, чтобы не перечитывать файл
+        _known_cache[path] = (_file_stamp(path), existing)
     return len(new_vals)
 
 # -------------------- LEDGER (SQLite) --------------------
 
+# Буфер ledger_put: пишем пачками, а не commit на каждого пользователя.
+# Сброс — по размеру пачки или по возрасту самой старой записи: при медленном темпе
+# (один инвайт в десятки секунд) результаты не висят в памяти долго.
+LEDGER_FLUSH_EVERY = 50
+LEDGER_FLUSH_SEC = 30.0
+# статусы, после которых пользователя для этой цели больше не трогаем
+LEDGER_DONE_STATUSES = frozenset(("ok", "already", "privacy", "invalid"))
+_ledger_pending: List[Tuple[str, str, Optional[int], Optional[str], str, str, str]] = []
+# буфер excluded_add — уходит в той же транзакции, что и ledger
+_excluded_pending: List[Tuple[str, Optional[int], Optional[str], str, str, str]] = []
+# time.monotonic() первой записи в пустых буферах (0 — буферы пусты)
+_pending_since = 0.0
+
+
+def _pending_due() -> bool:
+    """Пора ли сбросить буферы ledger/excluded (вызывать после добавления записи)."""
+    global _pending_since
+    now = time.monotonic()
+    if not _pending_since:
+        _pending_since = now
+    return (
+        len(_ledger_pending) >= LEDGER_FLUSH_EVERY
+        or len(_excluded_pending) >= LEDGER_FLUSH_EVERY
+        or now - _pending_since >= LEDGER_FLUSH_SEC
+    )
+
+# SQL горячих путей — константы: один и тот же текст запроса всегда попадает в кеш подготовленных выражений
+_SQL_LEDGER_PUT = (
+    "INSERT OR REPLACE INTO invites(target, user_key, user_id, username, status, reason, ts) VALUES (?,?,?,?,?,?,?)"
+)
+_SQL_EXCLUDED_ADD = """
+    INSERT INTO excluded_users(user_key, user_id, username, reason, hits, first_ts, last_ts)
+    VALUES(?,?,?,?,1,?,?)
+    ON CONFLICT(user_key) DO UPDATE SET
+        user_id=COALESCE(excluded.user_id, excluded_users.user_id),
+        username=COALESCE(excluded.username, excluded_users.username),
+        reason=excluded.reason,
+        hits=excluded_users.hits+1,
+        last_ts=excluded.last_ts
+"""
+
+# одно соединение на процесс: схема и pragma — один раз, кеш подготовленных запросов не теряется
+_CONN: Optional[sqlite3.Connection] = None
+
 def _db() -> sqlite3.Connection:
-    conn = sqlite3.connect(LEDGER_DB)
+    global _CONN
+    if _CONN is None:
+        # isolation_level=None: транзакции открываем явно (BEGIN … COMMIT в ledger_flush)
+        conn = sqlite3.connect(LEDGER_DB, isolation_level=None, check_same_thread=False, cached_statements=256)
+        _init_schema(conn)
+        _CONN = conn
+        atexit.register(_db_close)
+    return _CONN
+
+
+def _db_close() -> None:
+    """Дописать буфер ledger и закрыть соединение (atexit)."""
+    global _CONN
+    if _CONN is None:
+        return
+    try:
+        ledger_flush(_CONN)
+    finally:
+        _CONN.close()
+        _CONN = None
+
+
+def _init_schema(conn: sqlite3.Connection) -> None:
+    # busy_timeout — первым: параллельный процесс (второй инвайтер/парсер) не роняет нас "database is locked"
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
     conn.execute("""
         CREATE TABLE IF NOT EXISTS invites (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -387,10 +663,25 @@ def _db() -> sqlite3.Connection:
         )
     """)
 
+    # авторы, которых parsing_from_messages уже прогнал через фильтр и записал в файлы;
+    # outputs — маска SEEN_NAME | SEEN_ID: в какие файлы автор попал (повторный скан чата их не трогает)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS seen_authors (
+            target TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            outputs INTEGER NOT NULL DEFAULT 0,
+            ts TEXT NOT NULL,
+            PRIMARY KEY (target, user_id)
+        )
+    """)
+
     conn.commit()
-    return conn
 
 def ledger_get(conn: sqlite3.Connection, target: str, user_key: str) -> Optional[Tuple[str, str]]:
+    # сначала смотрим ещё не сброшенный буфер (самая свежая запись — последняя)
+    for row in reversed(_ledger_pending):
+        if row[0] == target and row[1] == user_key:
+            return row[4], row[5]
     cur = conn.execute(
         "SELECT status, reason FROM invites WHERE target=? AND user_key=? LIMIT 1",
         (target, user_key),
@@ -398,32 +689,83 @@ def ledger_get(conn: sqlite3.Connection, target: str, user_key: str) -> Optional
     row = cur.fetchone()
     return (row[0], row[1]) if row else None
 
+def ledger_load_processed(conn: sqlite3.Connection, target: str) -> Dict[str, str]:
+    """Все записи ledger для target одним SELECT: user_key -> status."""
+    ledger_flush(conn)
+    return dict(conn.execute("SELECT user_key, status FROM invites WHERE target=?", (target,)))
+
+def ledger_load_done(conn: sqlite3.Connection, target: str) -> set:
+    """Разом загружает user_key, уже окончательно обработанных для target (вместо ledger_get на каждого)."""
+    ledger_flush(conn)
+    # фильтр статусов — в SQL, чтобы не тащить в Python строки floodwait/failed/skip
+    marks = ",".join("?" * len(LEDGER_DONE_STATUSES))
+    cur = conn.execute(
+        f"SELECT user_key FROM invites WHERE target=? AND status IN ({marks})",
+        (target, *LEDGER_DONE_STATUSES),
+    )
+    # интернированные ключи: `in done` для ключей из parse_user_ref сводится к сравнению указателей
+    return {_intern(r[0]) for r in cur}
+
 def ledger_put(conn: sqlite3.Connection, target: str, user_key: str, user_id: Optional[int],
                username: Optional[str], status: str, reason: str = "") -> None:
+    """Кладёт запись в буфер; на диск уходит пачкой через ledger_flush (одна транзакция на пачку)."""
     ts = datetime.now(timezone.utc).isoformat()
-    conn.execute(
-        "INSERT OR REPLACE INTO invites(target, user_key, user_id, username, status, reason, ts) VALUES (?,?,?,?,?,?,?)",
-        (target, user_key, user_id, username, status, reason, ts),
-    )
-    conn.commit()
+    _ledger_pending.append((target, user_key, user_id, username, status, reason, ts))
+    if _pending_due():
+        ledger_flush(conn)
 
 
+def ledger_flush(conn: sqlite3.Connection) -> None:
+    """Сбрасывает накопленные ledger_put и excluded_add в БД одной транзакцией."""
+    invite_state_flush(conn, ())
 
-# -------------------- SESSION STATS (SQLite) --------------------
 
+# -------------------- SEEN AUTHORS (SQLite) --------------------
+
+# биты seen_authors.outputs: автор записан в usernames.txt / userids.txt
+SEEN_NAME = 1
+SEEN_ID = 2
+
+def seen_authors_load(conn: sqlite3.Connection, target: str, since_ts: str) -> Dict[int, int]:
+    """user_id -> outputs для авторов target, записанных не раньше since_ts (ISO, UTC)."""
+    cur = conn.execute("SELECT user_id, outputs FROM seen_authors WHERE target=? AND ts>?", (target, since_ts))
+    return dict(cur.fetchall())
+
+
+def seen_authors_add_many(conn: sqlite3.Connection, rows: List[Tuple[str, int, int, str]]) -> None:
+    """Пачка (target, user_id, outputs, ts) одной транзакцией; повторный автор перезаписывает строку."""
+    if not rows:
+        return
+    conn.execute("BEGIN")
+    try:
+        conn.executemany("INSERT OR REPLACE INTO seen_authors(target, user_id, outputs, ts) VALUES (?,?,?,?)", rows)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# -------------------- SESSION STATS (SQLite) --------------------
 
 
 def excluded_load_all(conn: sqlite3.Connection) -> set:
+    ledger_flush(conn)
     cur = conn.execute("SELECT user_key FROM excluded_users")
     return {r[0] for r in cur.fetchall()}
 
 
 def excluded_has(conn: sqlite3.Connection, user_key: str) -> bool:
+    if any(row[0] == user_key for row in _excluded_pending):
+        return True
     cur = conn.execute("SELECT 1 FROM excluded_users WHERE user_key=? LIMIT 1", (user_key,))
     return cur.fetchone() is not None
 
 
 def excluded_reason(conn: sqlite3.Connection, user_key: str) -> str:
+    # ещё не сброшенный буфер: самая свежая запись — последняя
+    for row in reversed(_excluded_pending):
+        if row[0] == user_key:
+            return row[3] or ''
     cur = conn.execute("SELECT reason FROM excluded_users WHERE user_key=? LIMIT 1", (user_key,))
     row = cur.fetchone()
     return row[0] if row and row[0] else ''
@@ -435,20 +777,66 @@ def excluded_add(conn: sqlite3.Connection, user_key: str, user_id: Optional[int]
     Эти пользователи больше не будут браться в работу (ускоряет прогон и убирает вечные ошибки).
     """
     ts = datetime.now(timezone.utc).isoformat()
-    conn.execute(
-        """
-        INSERT INTO excluded_users(user_key, user_id, username, reason, hits, first_ts, last_ts)
-        VALUES(?,?,?,?,1,?,?)
-        ON CONFLICT(user_key) DO UPDATE SET
-            user_id=COALESCE(excluded.user_id, excluded_users.user_id),
-            username=COALESCE(excluded.username, excluded_users.username),
-            reason=excluded.reason,
-            hits=excluded_users.hits+1,
-            last_ts=excluded.last_ts
-        """,
-        (user_key, user_id, username, reason, ts, ts),
-    )
-    conn.commit()
+    # пишется пачкой вместе с ledger (ledger_flush / invite_state_flush), а не commit на каждого
+    _excluded_pending.append((user_key, user_id, username, reason, ts, ts))
+    if _pending_due():
+        ledger_flush(conn)
+
+
+class ExcludedFilter:
+    """Bloom-фильтр перед excluded_users: в памяти ~10 бит на ключ вместо set/dict строк.
+
+    Отрицательный ответ (подавляющее большинство кандидатов) даёт bytearray без обращения к БД;
+    на срабатывании фильтра (исключённый или ложное, ~1%) — точная проверка excluded_has.
+    Интерфейс как у dict user_key -> reason: `in`, [key], [key] = reason.
+    """
+
+    FPR = 0.01
+
+    def __init__(self, conn: sqlite3.Connection, expected: int) -> None:
+        n = max(1024, int(expected))
+        self._conn = conn
+        self._m = max(8, int(-n * math.log(self.FPR) / (math.log(2) ** 2)))
+        self._k = max(1, round(self._m / n * math.log(2)))
+        self._bits = bytearray((self._m + 7) // 8)
+
+    @classmethod
+    def build(cls, conn: sqlite3.Connection) -> "ExcludedFilter":
+        """Фильтр по всему excluded_users; строки читаются курсором, без промежуточного set."""
+        ledger_flush(conn)
+        n = conn.execute("SELECT COUNT(*) FROM excluded_users").fetchone()[0]
+        # запас под добавления в ходе прогона, чтобы FPR не поплыл
+        flt = cls(conn, n * 2)
+        for (uk,) in conn.execute("SELECT user_key FROM excluded_users"):
+            flt._set(uk)
+        return flt
+
+    def _positions(self, key: str):
+        # двойное хеширование (Kirsch–Mitzenmacher): один blake2b на k позиций
+        d = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        m = self._m
+        return ((h1 + i * h2) % m for i in range(self._k))
+
+    def _set(self, key: str) -> None:
+        bits = self._bits
+        for p in self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        for p in self._positions(key):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return excluded_has(self._conn, key)
+
+    def __getitem__(self, key: str) -> str:
+        return excluded_reason(self._conn, key)
+
+    def __setitem__(self, key: str, reason: str) -> None:
+        # сама запись в excluded_users — через excluded_add; здесь только биты фильтра
+        self._set(key)
 
 def session_stats_load(conn: sqlite3.Connection, session_files: List[str]) -> Dict[str, "SessionState"]:
     """Load persisted session states from DB (blocked/frozen/banned + rolling counters).
@@ -457,15 +845,31 @@ def session_stats_load(conn: sqlite3.Connection, session_files: List[str]) -> Di
     """
     out: Dict[str, SessionState] = {}
     now = _now()
-    for sf in session_files:
-        cur = conn.execute(
-            "SELECT blocked_until,frozen_until,banned,ok,fail,attempts,last_invite_at,next_invite_at,"
-            "hour_window_start,hour_count,day_window_start,day_count FROM session_stats WHERE session_file=?",
-            (sf,),
+    # недостающие строки — одной пачкой, затем один SELECT вместо запроса на каждую сессию
+    ts = datetime.now(timezone.utc).isoformat()
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(
+            "INSERT OR IGNORE INTO session_stats(session_file, updated_at) VALUES (?,?)",
+            [(sf, ts) for sf in session_files],
+        )
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    wanted = set(session_files)
+    rows = {
+        r[0]: r[1:]
+        for r in conn.execute(
+            "SELECT session_file,blocked_until,frozen_until,banned,ok,fail,attempts,last_invite_at,next_invite_at,"
+            "hour_window_start,hour_count,day_window_start,day_count FROM session_stats"
         )
-        row = cur.fetchone()
+        if r[0] in wanted
+    }
+    for sf in session_files:
+        row = rows.get(sf)
+        st = SessionState(session_file=sf)
         if row:
-            st = SessionState(session_file=sf)
             st.blocked_until = float(row[0] or 0)
             st.frozen_until = float(row[1] or 0)
             st.banned = bool(row[2] or 0)
@@ -478,13 +882,6 @@ def session_stats_load(conn: sqlite3.Connection, session_files: List[str]) -> Di
             st.hour_count = int(row[9] or 0)
             st.day_window_start = float(row[10] or 0)
             st.day_count = int(row[11] or 0)
-        else:
-            st = SessionState(session_file=sf)
-            conn.execute(
-                "INSERT OR IGNORE INTO session_stats(session_file, updated_at) VALUES (?,?)",
-                (sf, datetime.now(timezone.utc).isoformat()),
-            )
-            conn.commit()
         # normalize windows if stale
         if st.hour_window_start <= 0 or now - st.hour_window_start >= 3600:
             st.hour_window_start = now
@@ -496,29 +893,59 @@ def session_stats_load(conn: sqlite3.Connection, session_files: List[str]) -> Di
     return out
 
 
-def session_stats_save(conn: sqlite3.Connection, st: "SessionState") -> None:
-    conn.execute(
-        "UPDATE session_stats SET blocked_until=?, frozen_until=?, banned=?, ok=?, fail=?, attempts=?, "
-        "last_invite_at=?, next_invite_at=?, hour_window_start=?, hour_count=?, day_window_start=?, day_count=?, updated_at=? "
-        "WHERE session_file=?",
-        (
-            float(st.blocked_until or 0),
-            float(st.frozen_until or 0),
-            1 if st.banned else 0,
-            int(st.ok or 0),
-            int(st.fail or 0),
-            int(st.attempts or 0),
-            float(st.last_invite_at or 0),
-            float(st.next_invite_at or 0),
-            float(getattr(st, "hour_window_start", 0) or 0),
-            int(getattr(st, "hour_count", 0) or 0),
-            float(getattr(st, "day_window_start", 0) or 0),
-            int(getattr(st, "day_count", 0) or 0),
-            datetime.now(timezone.utc).isoformat(),
-            st.session_file,
-        ),
+_SQL_SESSION_STATS_SAVE = (
+    "UPDATE session_stats SET blocked_until=?, frozen_until=?, banned=?, ok=?, fail=?, attempts=?, "
+    "last_invite_at=?, next_invite_at=?, hour_window_start=?, hour_count=?, day_window_start=?, day_count=?, updated_at=? "
+    "WHERE session_file=?"
+)
+
+# как часто инвайтер сбрасывает изменённые (dirty) состояния сессий в БД
+SESSION_STATS_FLUSH_SEC = 30.0
+
+
+def _session_stats_row(st: "SessionState", ts: str) -> Tuple[Any, ...]:
+    return (
+        float(st.blocked_until or 0),
+        float(st.frozen_until or 0),
+        1 if st.banned else 0,
+        int(st.ok or 0),
+        int(st.fail or 0),
+        int(st.attempts or 0),
+        float(st.last_invite_at or 0),
+        float(st.next_invite_at or 0),
+        float(st.hour_window_start or 0),
+        int(st.hour_count or 0),
+        float(st.day_window_start or 0),
+        int(st.day_count or 0),
+        ts,
+        st.session_file,
     )
+
+
+def invite_state_flush(conn: sqlite3.Connection, states: Iterable["SessionState"]) -> None:
+    """Буферы ledger/excluded и изменённые состояния сессий — одной транзакцией (один commit на пачку)."""
+    global _pending_since
+    dirty = [st for st in states if st.dirty]
+    if not dirty and not _ledger_pending and not _excluded_pending:
+        return
+    ts = datetime.now(timezone.utc).isoformat()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if _ledger_pending:
+            conn.executemany(_SQL_LEDGER_PUT, _ledger_pending)
+        if _excluded_pending:
+            conn.executemany(_SQL_EXCLUDED_ADD, _excluded_pending)
+        if dirty:
+            conn.executemany(_SQL_SESSION_STATS_SAVE, [_session_stats_row(st, ts) for st in dirty])
+    except Exception:
+        conn.rollback()
+        raise
     conn.commit()
+    _ledger_pending.clear()
+    _excluded_pending.clear()
+    _pending_since = 0.0
+    for st in dirty:
+        st.dirty = False
 
 
 def session_next_time_due_to_limits(st: "SessionState", per_hour_limit: int, per_day_limit: int) -> float:
@@ -545,6 +972,23 @@ def session_consume_invite_token(st: "SessionState", per_hour_limit: int, per_da
         st.hour_count = int(getattr(st, "hour_count", 0) or 0) + 1
     if per_day_limit:
         st.day_count = int(getattr(st, "day_count", 0) or 0) + 1
+
+
+def session_window_push(st: "SessionState", now: float, per_minute_limit: int) -> float:
+    """Records an invite in the session's 60s window.
+
+    Returns the timestamp when the window frees a slot if it is full (else 0).
+    """
+    if not per_minute_limit:
+        return 0.0
+    win = st.window
+    win.append(now)
+    while win and now - win[0] >= 60:
+        win.popleft()
+    if len(win) >= int(per_minute_limit):
+        return win[0] + 60
+    return 0.0
+
 # -------------------- CORE OPS --------------------
 
 def parsing(client: TelegramClient, chat_entity: Union[str, int, Any], parse_id: bool, parse_name: bool) -> None:
@@ -554,28 +998,50 @@ def parsing(client: TelegramClient, chat_entity: Union[str, int, Any], parse_id:
       - usernames.txt (с @)
       - userids.txt
     """
-    log_info(f"🔍 Начат парсинг: {chat_entity}")
+    # Весь проход — одна корутина: без run_until_complete на каждого участника (как делает telethon.sync)
+    client.loop.run_until_complete(_parsing_async(client, chat_entity, parse_id, parse_name))
+    log_flush()
+
+
+# размер страницы GetParticipants — столько же пользователей фильтруем за раз
+PARSE_PAGE = 200
+
+
+async def _parsing_async(client: TelegramClient, chat_entity: Union[str, int, Any], parse_id: bool, parse_name: bool) -> None:
+    log_info("🔍 Начат парсинг: %s", chat_entity)
     good_usernames: List[str] = []
     good_ids: List[str] = []
 
     total = 0
     kept = 0
-    skipped = {}
+    skipped: Counter = Counter()
+    now = datetime.now(timezone.utc)
 
-    for user in client.iter_participants(chat_entity):
-        total += 1
-        ok, reason = quality_hard(user)
-        if not ok:
-            skipped[reason] = skipped.get(reason, 0) + 1
-            continue
+    def take_page(page: List[Any]) -> None:
+        nonlocal kept
+        for user, (ok, reason) in zip(page, quality_hard_batch(page, now)):
+            if not ok:
+                skipped[reason] += 1
+                continue
 
-        kept += 1
-        if parse_name and user.username:
-            good_usernames.append(user.username)
-        if parse_id:
-            ref = id_ref_from_userobj(user)
-            if ref:
-                good_ids.append(ref)
+            kept += 1
+            if parse_name and user.username:
+                good_usernames.append(user.username)
+            if parse_id:
+                ref = id_ref_from_userobj(user)
+                if ref:
+                    good_ids.append(ref)
+
+    # фильтруем страницами (как их отдаёт GetParticipants), а не по одному
+    page: List[Any] = []
+    async for user in client.iter_participants(chat_entity):
+        page.append(user)
+        if len(page) >= PARSE_PAGE:
+            take_page(page)
+            total += len(page)
+            page = []
+    take_page(page)
+    total += len(page)
 
     added_u = added_i = 0
     if parse_name:
@@ -583,10 +1049,16 @@ def parsing(client: TelegramClient, chat_entity: Union[str, int, Any], parse_id:
     if parse_id:
         added_i = _append_unique("userids.txt", good_ids, prefix_at=False)
 
-    log_ok(f"✅ Парсинг завершён. Всего: {total}, прошло фильтр: {kept}, добавлено usernames: {added_u}, ids: {added_i}")
+    log_ok("✅ Парсинг завершён. Всего: %s, прошло фильтр: %s, добавлено usernames: %s, ids: %s", total, kept, added_u, added_i)
     if skipped:
-        parts = ", ".join([f"{k}={v}" for k, v in sorted(skipped.items(), key=lambda x: -x[1])])
-        log_info(f"📉 Отфильтровано: {parts}")
+        parts = ", ".join([f"{k}={v}" for k, v in skipped.most_common()])
+        log_info("📉 Отфильтровано: %s", parts)
+
+
+# сколько авторов без sender резолвим одним asyncio.gather
+RESOLVE_BATCH = 50
+# одна страница GetParticipants (недавние участники) — прогрев кэша авторов перед сканом сообщений
+PREFETCH_PARTICIPANTS = 200
 
 
 def parsing_from_messages(
@@ -604,7 +1076,21 @@ def parsing_from_messages(
       - usernames.txt (с @)
       - userids.txt
     """
-    log_info(f"🔍 Начат парсинг из сообщений: {chat_entity} | лимит сообщений={limit_messages} | возраст≤{max_age_days}д")
+    client.loop.run_until_complete(
+        _parsing_from_messages_async(client, chat_entity, parse_id, parse_name, limit_messages, max_age_days)
+    )
+    log_flush()
+
+
+async def _parsing_from_messages_async(
+    client: TelegramClient,
+    chat_entity: Union[str, int, Any],
+    parse_id: bool,
+    parse_name: bool,
+    limit_messages: int,
+    max_age_days: int,
+) -> None:
+    log_info("🔍 Начат парсинг из сообщений: %s | лимит сообщений=%s | возраст≤%sд", chat_entity, limit_messages, max_age_days)
     print("Старт: парсинг из сообщений… Это может занять время. Прогресс будет обновляться.", flush=True)
     good_usernames: List[str] = []
     good_ids: List[str] = []
@@ -612,12 +1098,72 @@ def parsing_from_messages(
     scanned = 0
     unique_found = 0
     kept = 0
-    skipped: Dict[str, int] = {}
+    skipped: Counter = Counter()
 
+    # авторы, у которых в сообщении не пришёл sender — резолвим пачками
+    unresolved: List[int] = []
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=max_age_days)
+
+    # авторы, записанные прошлыми прогонами по этому чату в пределах окна max_age_days, — пропускаем,
+    # если они уже есть во всех файлах, которые нужны этому прогону
+    conn = _db()
+    chat_key = _target_key(chat_entity)
+    now_ts = now.isoformat()
+    week_ago = now - _ACTIVE_WINDOW
+    wanted = (SEEN_NAME if parse_name else 0) | (SEEN_ID if parse_id else 0)
+    known: Dict[int, int] = seen_authors_load(conn, chat_key, cutoff.isoformat())
+    # авторы, уже встреченные в этом прогоне (каждый считается один раз)
     seen_user_ids: set = set()
-    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    # прошедшие фильтр: в seen_authors — только после записи в файлы
+    seen_pending: List[Tuple[str, int, int, str]] = []
+    skipped_known = 0
+
+    # id -> User: прогрев одной страницей участников (если список скрыт — просто пустой)
+    user_cache: Dict[int, Any] = {}
+    try:
+        for u in await client.get_participants(chat_entity, limit=PREFETCH_PARTICIPANTS):
+            user_cache[u.id] = u
+    except Exception:
+        pass
+
+    def take(user: Any) -> None:
+        nonlocal kept
+        ok, reason = quality_hard(user, now, week_ago)
+        if not ok:
+            skipped[reason] += 1
+            return
+        kept += 1
+        outputs = known.get(user.id, 0)
+        if parse_name and getattr(user, "username", None):
+            good_usernames.append(user.username)
+            outputs |= SEEN_NAME
+        if parse_id:
+            ref = id_ref_from_userobj(user)
+            if ref:
+                good_ids.append(ref)
+                outputs |= SEEN_ID
+        seen_pending.append((chat_key, user.id, outputs, now_ts))
+
+    async def resolve_pending() -> None:
+        if not unresolved:
+            return
+        batch = unresolved[:]
+        unresolved.clear()
+        try:
+            # список id — один users.getUsers на всю пачку
+            users = await client.get_entity(batch)
+        except Exception:
+            # хотя бы один id не резолвится — тогда по одному, чтобы не потерять остальных
+            users = await asyncio.gather(*[client.get_entity(sid) for sid in batch], return_exceptions=True)
+        for sid, user in zip(batch, users):
+            if user is None or isinstance(user, BaseException):
+                skipped["не удалось получить пользователя"] += 1
+                continue
+            user_cache[sid] = user
+            take(user)
 
-    for msg in client.iter_messages(chat_entity, limit=limit_messages):
+    async for msg in client.iter_messages(chat_entity, limit=limit_messages):
         # Периодический прогресс в консоль (чтобы не казалось, что всё зависло)
         scanned += 1
         if scanned % 200 == 0:
@@ -638,56 +1184,44 @@ def parsing_from_messages(
             if sid in seen_user_ids:
                 continue
             seen_user_ids.add(sid)
+            if known.get(sid, 0) & wanted == wanted:
+                skipped_known += 1
+                continue
             unique_found += 1
 
-            # Получаем объект пользователя
-            user = getattr(msg, "sender", None)
+            # Обычно Telethon уже приложил автора к сообщению; иначе — кэш, и только потом пакетный резолв
+            user = getattr(msg, "sender", None) or user_cache.get(sid)
             if user is None:
-                try:
-                    user = msg.get_sender()
-                except Exception:
-                    user = None
-            if user is None:
-                try:
-                    user = client.get_entity(sid)
-                except Exception:
-                    user = None
-            if user is None:
-                skipped["не удалось получить пользователя"] = skipped.get("не удалось получить пользователя", 0) + 1
-                continue
-
-            ok, reason = quality_hard(user)
-            if not ok:
-                skipped[reason] = skipped.get(reason, 0) + 1
+                unresolved.append(sid)
+                if len(unresolved) >= RESOLVE_BATCH:
+                    await resolve_pending()
                 continue
 
-            kept += 1
-            if parse_name and getattr(user, "username", None):
-                good_usernames.append(user.username)
-            if parse_id:
-                ref = id_ref_from_userobj(user)
-                if ref:
-                    good_ids.append(ref)
+            take(user)
 
         except Exception as e:
-            skipped["ошибка сообщения"] = skipped.get("ошибка сообщения", 0) + 1
-            log_warn(f"⚠️ Ошибка при обработке сообщения: {e}")
+            skipped["ошибка сообщения"] += 1
+            log_warn("⚠️ Ошибка при обработке сообщения: %s", e)
+
+    await resolve_pending()
 
     added_u = added_i = 0
     if parse_name:
         added_u = _append_unique("usernames.txt", good_usernames, prefix_at=True)
     if parse_id:
         added_i = _append_unique("userids.txt", good_ids, prefix_at=False)
+    seen_authors_add_many(conn, seen_pending)
 
     log_ok(
-        f"✅ Парсинг из сообщений завершён. Сообщений просмотрено: {scanned}, уникальных авторов: {unique_found}, прошло фильтр: {kept}, "
-        f"добавлено usernames: {added_u}, ids: {added_i}"
+        "✅ Парсинг из сообщений завершён. Сообщений просмотрено: %s, уникальных авторов: %s, прошло фильтр: %s, "
+        "добавлено usernames: %s, ids: %s, известных по прошлым прогонам: %s",
+        scanned, unique_found, kept, added_u, added_i, skipped_known,
     )
     print()  # перевод строки после прогресс-строки
     print("Готово: парсинг из сообщений завершён. Итоги — в app.log и файлах usernames.txt/userids.txt", flush=True)
     if skipped:
-        parts = ", ".join([f"{k}={v}" for k, v in sorted(skipped.items(), key=lambda x: -x[1])])
-        log_info(f"📉 Отфильтровано/пропущено: {parts}")
+        parts = ", ".join([f"{k}={v}" for k, v in skipped.most_common()])
+        log_info("📉 Отфильтровано/пропущено: %s", parts)
 
 def _target_key(target: Any) -> str:
     """Стабильный ключ для target в ledger."""
@@ -738,18 +1272,125 @@ def _make_client(session_file: str, api_id: int, api_hash: str) -> TelegramClien
     client = TelegramClient(session_name, api_id, api_hash)
     client.connect()
     if not client.is_user_authorized():
+        client.disconnect()
         raise RuntimeError(f"Сессия не авторизована: {session_file}")
     return client
 
 
+# Подключённые клиенты по session_file (LRU): preflight и ротация инвайта переиспользуют
+# одно соединение вместо нового connect/handshake на каждую смену сессии.
+CLIENT_POOL_SIZE = 32
+_CLIENTS: "OrderedDict[str, TelegramClient]" = OrderedDict()
+
+
+def _disconnect_quiet(client: TelegramClient) -> None:
+    try:
+        client.disconnect()
+    except Exception:
+        pass
+
+
+def get_pooled_client(session_file: str, api_id: int, api_hash: str) -> TelegramClient:
+    """Клиент из пула (переподключается, если соединение упало), иначе — новый через _make_client."""
+    c = _CLIENTS.get(session_file)
+    if c is not None:
+        try:
+            if not c.is_connected():
+                c.connect()
+            _CLIENTS.move_to_end(session_file)
+            return c
+        except Exception:
+            del _CLIENTS[session_file]
+            _disconnect_quiet(c)
+    c = _make_client(session_file, api_id, api_hash)
+    _CLIENTS[session_file] = c
+    while len(_CLIENTS) > CLIENT_POOL_SIZE:
+        _, old = _CLIENTS.popitem(last=False)
+        _disconnect_quiet(old)
+    return c
+
+
+def drop_pooled_client(session_file: str) -> None:
+    """Убрать сессию из пула и отключить (авторизация слетела — соединение больше не нужно)."""
+    c = _CLIENTS.pop(session_file, None)
+    if c is not None:
+        _disconnect_quiet(c)
+
+
+def close_pooled_clients() -> None:
+    while _CLIENTS:
+        _, c = _CLIENTS.popitem()
+        _disconnect_quiet(c)
+
+
+# цель, разрезолвленная в сессии: (session_file, ссылка на цель) -> InputPeer. access_hash привязан
+# к конкретному аккаунту, поэтому ключ — пара. Живёт весь процесс: preflight и следующий за ним инвайт
+# не резолвят цель заново.
+# Резолв — через get_input_entity: если аккаунт уже видел цель, InputPeer берётся из его .session
+# без сети (get_entity всегда ходил бы за полным объектом). Полный объект нужен только диагностике.
+_TARGET_ENTITIES: Dict[Tuple[str, Any], Any] = {}
+
+
+def _target_cache_key(target: Any) -> Any:
+    return target if isinstance(target, (str, int)) else _target_key(target)
+
+
+async def _open_client_async(session_file: str, api_id: int, api_hash: str, target: Any = None):
+    """Async-вариант _make_client; заодно резолвит target в этой сессии (None, если не вышло)."""
+    client = TelegramClient(session_name_from_file(session_file), api_id, api_hash)
+    await client.connect()
+    if not await client.is_user_authorized():
+        await client.disconnect()
+        raise RuntimeError(f"Сессия не авторизована: {session_file}")
+    entity = None
+    if target is not None:
+        try:
+            entity = await client.get_input_entity(target)
+        except Exception:
+            pass
+    return client, entity
+
+
+def warm_pooled_clients(session_files: List[str], api_id: int, api_hash: str, target: Any = None) -> Dict[str, Any]:
+    """Подключает ещё не открытые сессии параллельно (asyncio.gather) и кладёт их в пул.
+
+    Connect/handshake и get_entity(target) по сети идут одновременно для всех сессий, а не по очереди
+    при первом выборе каждой. Возвращает session_file -> target entity для тех, где резолв удался.
+    Неавторизованные/упавшие сессии в пул не попадают — их отсеет get_pooled_client как обычно.
+    """
+    missing = [sf for sf in dict.fromkeys(session_files) if sf not in _CLIENTS][:CLIENT_POOL_SIZE]
+    if not missing:
+        return {}
+    # тот же loop, на котором работают sync-клиенты Telethon
+    loop = tl_helpers.get_running_loop()
+    results = loop.run_until_complete(asyncio.gather(
+        *[_open_client_async(sf, api_id, api_hash, target) for sf in missing], return_exceptions=True,
+    ))
+    entities: Dict[str, Any] = {}
+    for sf, res in zip(missing, results):
+        if isinstance(res, BaseException):
+            continue
+        client, entity = res
+        _CLIENTS[sf] = client
+        if entity is not None:
+            entities[sf] = entity
+            _TARGET_ENTITIES[(sf, _target_cache_key(target))] = entity
+    while len(_CLIENTS) > CLIENT_POOL_SIZE:
+        _, old = _CLIENTS.popitem(last=False)
+        _disconnect_quiet(old)
+    return entities
+
+
+atexit.register(close_pooled_clients)
 
 
 # -------------------- INVITE ORCHESTRATION (PRO MODE) --------------------
 
-from dataclasses import dataclass
+# __slots__ у dataclass — с Python 3.10 (README допускает 3.9: там остаётся обычный __dict__)
+_DATACLASS_SLOTS: Dict[str, Any] = {"slots": True} if sys.version_info >= (3, 10) else {}
 
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class SessionState:
     session_file: str
     blocked_until: float = 0.0   # unix timestamp
@@ -764,16 +1405,70 @@ class SessionState:
     ok: int = 0
     fail: int = 0
     attempts: int = 0
+    # не сохраняется в БД: окно инвайтов за последнюю минуту и текущий backoff сессии
+    window: Deque[float] = field(default_factory=deque)
+    backoff: float = 0.0
+    # есть несохранённые изменения (см. invite_state_flush)
+    dirty: bool = False
 
 
 def _now() -> float:
     return time.time()
 
 
+class TokenBucket:
+    """Адаптивный token bucket (ATB) для темпа инвайтов одной сессии.
+
+    Успех — rate растёт на step, FloodWait — делится на backoff, но не ниже min_rate.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, min_rate: float = 1 / 30, max_rate: float = 1.0,
+                 step: float = 0.01, backoff: float = 2.0) -> None:
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.rate = min(self.max_rate, max(self.min_rate, float(rate)))
+        self.burst = max(1, int(burst))
+        self.step = float(step)
+        self.backoff = float(backoff)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+
+    def acquire(self) -> None:
+        """Блокирует, пока не появится токен."""
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens < 1.0:
+            time.sleep((1.0 - self._tokens) / self.rate)
+            self._tokens = 1.0
+            self._last = time.monotonic()
+        self._tokens -= 1.0
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.step)
+
+    def on_flood(self) -> None:
+        self.rate = max(self.min_rate, self.rate / self.backoff)
+
+
+# (минута эпохи, минута локальных суток): localtime — раз в минуту, а не на каждого пользователя
+_local_minute_cache: List[int] = [-1, 0]
+
+
+def _local_minute_of_day(now_sec: float) -> int:
+    """Minutes since local midnight for now_sec (cached per epoch minute)."""
+    epoch_min = int(now_sec // 60)
+    cache = _local_minute_cache
+    if cache[0] != epoch_min:
+        lt = time.localtime(now_sec)
+        cache[0] = epoch_min
+        cache[1] = lt.tm_hour * 60 + lt.tm_min
+    return cache[1]
+
+
 def _is_time_in_window(now_sec: float, start_h: int, start_m: int, end_h: int, end_m: int) -> bool:
     """Returns True if local time is inside [start, end] window. Supports window crossing midnight."""
-    lt = time.localtime(now_sec)
-    cur = lt.tm_hour * 60 + lt.tm_min
+    cur = _local_minute_of_day(now_sec)
     start = int(start_h) * 60 + int(start_m)
     end = int(end_h) * 60 + int(end_m)
     if start <= end:
@@ -785,8 +1480,7 @@ def _seconds_until_window_end(now_sec: float, start_h: int, start_m: int, end_h:
     """If we are inside a window, returns seconds until its end, else 0."""
     if not _is_time_in_window(now_sec, start_h, start_m, end_h, end_m):
         return 0
-    lt = time.localtime(now_sec)
-    cur_min = lt.tm_hour * 60 + lt.tm_min
+    cur_min = _local_minute_of_day(now_sec)
     end_min = int(end_h) * 60 + int(end_m)
     start_min = int(start_h) * 60 + int(start_m)
     # window not crossing midnight
@@ -801,20 +1495,81 @@ def _seconds_until_window_end(now_sec: float, start_h: int, start_m: int, end_h:
     return max(0, minutes_left * 60)
 
 
-def _pick_best_session(states: List[SessionState]) -> Optional[SessionState]:
-    """Pick best available session: not banned, not frozen/blocked, earliest next_invite_at."""
-    now = _now()
-    candidates = []
-    for st in states:
-        if st.banned:
-            continue
-        ready_at = max(st.blocked_until, st.frozen_until, st.next_invite_at)
-        candidates.append((ready_at, st.last_invite_at, st.attempts, st))
-    if not candidates:
+def _next_window_check_at(now_sec: float, start_h: int, start_m: int, end_h: int, end_m: int) -> float:
+    """When the night window must be checked next: now if inside it, else the start of the window.
+
+    Capped at one hour ahead so a DST shift can't make us miss the window start.
+    """
+    if _is_time_in_window(now_sec, start_h, start_m, end_h, end_m):
+        return now_sec
+    start = int(start_h) * 60 + int(start_m)
+    minutes_left = (start - _local_minute_of_day(now_sec)) % (24 * 60)
+    return min(now_sec - now_sec % 60 + minutes_left * 60, now_sec + 3600)
+
+
+def _session_order_key(st: SessionState) -> Tuple[float, float, int]:
+    """Порядок выбора сессии: раньше готова, дольше не инвайтила, меньше попыток."""
+    return (max(st.blocked_until, st.frozen_until, st.next_invite_at), st.last_invite_at, st.attempts)
+
+
+def _penalize(st: Optional[SessionState], until: float = 0.0) -> None:
+    """Неудача сессии: fail/attempts +1 и блок до until (если позже текущего); в БД — со следующим flush."""
+    if st is None:
+        return
+    st.fail += 1
+    st.attempts += 1
+    if until > st.blocked_until:
+        st.blocked_until = until
+    st.dirty = True
+
+
+def _penalize_unauthorized(st: Optional[SessionState], now: float) -> None:
+    """Сессия не авторизована: в бан (из ротации) + обычный штраф."""
+    if st is None:
+        return
+    st.banned = True
+    st.next_invite_at = max(st.next_invite_at, now + 3600)
+    _penalize(st)
+
+
+class SessionHeap:
+    """Min-heap сессий по (готова_в, last_invite_at, attempts) с ленивым удалением.
+
+    Поля состояния сессии в ротации только растут (блок/заморозка/next_invite_at через max(),
+    attempts += 1), поэтому ключ в куче — нижняя граница текущего. На pick() верхушка
+    сверяется с актуальным ключом: устаревшая запись переразмещается, забаненная — выбрасывается.
+    Забаненные сессии в кучу не попадают вовсе.
+    """
+
+    def __init__(self, states: List[SessionState]) -> None:
+        self._heap = [(_session_order_key(st), i, st) for i, st in enumerate(states) if not st.banned]
+        heapq.heapify(self._heap)
+
+    def pick(self) -> Optional[SessionState]:
+        """Лучшая сессия (по _session_order_key), без удаления из кучи."""
+        heap = self._heap
+        while heap:
+            key, seq, st = heap[0]
+            if st.banned:
+                heapq.heappop(heap)
+                continue
+            cur = _session_order_key(st)
+            if cur != key:
+                heapq.heapreplace(heap, (cur, seq, st))
+                continue
+            return st
         return None
-    # prefer already-ready, else earliest ready time
-    candidates.sort(key=lambda x: (x[0], x[1], x[2]))
-    return candidates[0][3]
+
+
+def _fmt_duration(sec: float) -> str:
+    """Длительность для логов: '1ч 2м 3с' / '2м 3с' / '3с'."""
+    m, s = divmod(int(max(0, sec)), 60)
+    h, m = divmod(m, 60)
+    return f"{h}ч {m}м {s}с" if h else (f"{m}м {s}с" if m else f"{s}с")
+
+
+# паузы короче — обычный темп сессий между инвайтами (jitter уже в next_invite_at): спим молча
+PACE_QUIET_SEC = 60.0
 
 
 def _sleep_until_ready(states: List[SessionState], extra_jitter: Tuple[float, float] = (2.0, 6.0)) -> None:
@@ -822,6 +1577,7 @@ def _sleep_until_ready(states: List[SessionState], extra_jitter: Tuple[float, fl
 
     v10.1: Writes a clear message when ALL sessions are waiting, so it doesn't look like the bot froze.
     For long waits, sleeps in chunks and prints progress occasionally.
+    Short pacing waits (< PACE_QUIET_SEC) are slept silently, without extra jitter.
     """
     now = _now()
     soonest = None
@@ -837,40 +1593,28 @@ def _sleep_until_ready(states: List[SessionState], extra_jitter: Tuple[float, fl
     wait = max(0.0, soonest - now)
     if wait <= 0:
         return
+    if wait < PACE_QUIET_SEC:
+        time.sleep(wait)
+        return
 
     # Add small jitter so sessions don't all wake at the exact same moment
     wait = wait + random.uniform(*extra_jitter)
 
-    def _fmt(sec: float) -> str:
-        sec = int(max(0, sec))
-        h = sec // 3600
-        m = (sec % 3600) // 60
-        s = sec % 60
-        if h > 0:
-            return f"{h}ч {m}м {s}с"
-        if m > 0:
-            return f"{m}м {s}с"
-        return f"{s}с"
-
-    msg = f"Все сессии на паузе — жду ближайшую примерно через {_fmt(wait)}"
+    msg = f"Все сессии на паузе — жду ближайшую примерно через {_fmt_duration(wait)}"
     try:
         print('ℹ️ ' + msg, flush=True)
     except Exception:
         pass
     log_pause(msg)
 
-    # For long waits, sleep in chunks and occasionally report remaining time
+    # For long waits, sleep in report-sized chunks: one wakeup per progress line (every 5 minutes), not every minute
     remaining = wait
-    last_report = 0.0
     while remaining > 0:
-        chunk = 60.0 if remaining > 90 else remaining
+        chunk = min(remaining, 300.0)
         time.sleep(chunk)
         remaining -= chunk
-        last_report += chunk
-        # report roughly every 5 minutes if still waiting
-        if remaining > 120 and last_report >= 300:
-            last_report = 0.0
-            msg2 = f"Все еще жду: осталось примерно {_fmt(remaining)}"
+        if remaining > 120:
+            msg2 = f"Все еще жду: осталось примерно {_fmt_duration(remaining)}"
             try:
                 print('ℹ️ ' + msg2, flush=True)
             except Exception:
@@ -893,38 +1637,111 @@ def id_ref_from_userobj(user: Any) -> str:
     return ""
 
 
+# user_key (id:/u:) интернируются: одинаковые ключи из файлов и из ledger — один объект,
+# сравнение в set/dict по указателю. Статусы — литералы, их интернирует компилятор.
+_intern = sys.intern
+
+# шаблоны parse_user_ref: компилируем один раз, а не через кеш re на каждом вызове
+_RE_ID_HASH = re.compile(r"(\d+):(\d+)")
+_RE_UNAME = re.compile(r"[A-Za-z0-9_]{4,}")
+
+
 def parse_user_ref(raw: Any) -> Tuple[str, Optional[int], Optional[str], Any]:
     # Returns (user_key, user_id, username, entity)
     # entity is one of: InputPeerUser(id,hash), '@username', int(id)
-    if isinstance(raw, int) or (isinstance(raw, str) and raw.strip().isdigit()):
+    if isinstance(raw, int):
         uid = int(raw)
-        return f"id:{uid}", uid, None, uid
+        return _intern(f"id:{uid}"), uid, None, uid
 
     s = str(raw).strip()
     if not s:
         return 'empty', None, None, None
 
-    if s.startswith('@'):
+    first = s[0]
+    if first == '@':
         uname = s[1:]
-        return f"u:{uname.lower()}", None, uname, '@' + uname
-
-    m = re.fullmatch(r"(\d+):(\d+)", s)
-    if m:
-        uid = int(m.group(1))
-        ah = int(m.group(2))
-        return f"id:{uid}", uid, None, InputPeerUser(uid, ah)
+        return _intern(f"u:{uname.lower()}"), None, uname, '@' + uname
+
+    if first.isdigit():
+        if s.isdigit():
+            uid = int(s)
+            return _intern(f"id:{uid}"), uid, None, uid
+        m = _RE_ID_HASH.fullmatch(s)
+        if m:
+            uid = int(m.group(1))
+            ah = int(m.group(2))
+            return _intern(f"id:{uid}"), uid, None, InputPeerUser(uid, ah)
 
     # plain username without @
-    if re.fullmatch(r"[A-Za-z0-9_]{4,}", s):
+    if _RE_UNAME.fullmatch(s):
         uname = s
-        return f"u:{uname.lower()}", None, uname, '@' + uname
+        return _intern(f"u:{uname.lower()}"), None, uname, '@' + uname
 
     return f"raw:{s}", None, None, s
 
 
+def _iter_candidates(
+    users: Iterable[Union[str, int]],
+    done: set,
+    excluded: Optional["ExcludedFilter"] = None,
+    stats: Optional[Counter] = None,
+    on_excluded: Optional[Any] = None,
+) -> Iterator[Tuple[Any, str, Optional[int], Optional[str], Any]]:
+    """Лениво нормализовать поток пользователей для цикла инвайта: (raw, user_key, user_id, username, entity).
+
+    Пустые строки, повторы, уже обработанные для цели (done) и исключённые (excluded) отбрасываются,
+    порядок сохраняется. Кандидат разбирается только когда до него дошёл цикл: в памяти нет ни списка
+    пользователей, ни списка кортежей. Исключённые отдаются в on_excluded(user_key, user_id, username).
+    stats["total"] — уникальные пользователи на входе, stats["skipped"] — отброшенные done/excluded.
+    """
+    # ключи из parse_user_ref интернированы: повтор одного и того же пользователя не создаёт
+    # новой строки в seen, а проверки in сводятся к сравнению указателей
+    seen: set = set()
+    if stats is None:
+        stats = Counter()
+    for raw in users:
+        user_key, user_id, username, entity = parse_user_ref(raw)
+        if user_key == "empty" or user_key in seen:
+            continue
+        # total — уникальные пользователи на входе: повторы в файлах пропуском не считаются
+        stats["total"] += 1
+        seen.add(user_key)
+        if user_key in done:
+            stats["skipped"] += 1
+            continue
+        if excluded is not None and user_key in excluded:
+            stats["skipped"] += 1
+            if on_excluded is not None:
+                on_excluded(user_key, user_id, username)
+            continue
+        yield raw, user_key, user_id, username, entity
+
+
+def _fast_copy(src: str, dst: str) -> None:
+    """Копия файла в ядре (os.copy_file_range, Linux); иначе — shutil.copy2. Метаданные как у copy2."""
+    import shutil
+    copy_range = getattr(os, "copy_file_range", None)
+    if copy_range is None:
+        shutil.copy2(src, dst)
+        return
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            while copy_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+                pass
+        except OSError:
+            # ФС/ядро без copy_file_range (или между устройствами на старых ядрах)
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copystat(src, dst)
+
+
+# буфер чтения/записи при очистке списков: 1 МБ вместо 8 КБ по умолчанию — на порядки меньше read/write
+PRUNE_IO_BUFFER = 1 << 20
 
 
-def prune_users_files(target: Union[str, int, Any], statuses: Tuple[str, ...] = ("ok","already","privacy","invalid"), include_excluded: bool = True) -> Tuple[int,int]:
+def prune_users_files(target: Union[str, int, Any], statuses: Iterable[str] = LEDGER_DONE_STATUSES, include_excluded: bool = True) -> Tuple[int,int]:
     """Удаляет из usernames.txt и userids.txt тех, кто уже обработан по target (ledger) и/или в excluded_users.
 
     Возвращает (removed, kept).
@@ -932,6 +1749,7 @@ def prune_users_files(target: Union[str, int, Any], statuses: Tuple[str, ...] =
     """
     conn = _db()
     target_key = _target_key(target)
+    statuses = frozenset(statuses)
 
     removed = 0
     kept = 0
@@ -939,85 +1757,121 @@ def prune_users_files(target: Union[str, int, Any], statuses: Tuple[str, ...] =
     # load excluded cache
     excl = excluded_load_all(conn) if include_excluded else set()
 
-    # build set of processed user_keys for target
-    q = "SELECT user_key, status FROM invites WHERE target=?"
-    proc = {}
-    for uk, st in conn.execute(q, (target_key,)).fetchall():
-        proc[uk] = st
-
-    def should_remove(user_key: str) -> bool:
-        st = proc.get(user_key)
-        if st and st in statuses:
-            return True
-        if include_excluded and user_key in excl:
-            return True
-        return False
+    # processed user_keys for target
+    proc = ledger_load_processed(conn, target_key)
+
+    # всё, что надо выкинуть, — одно множество: на строку один `in`
+    remove_set = {uk for uk, st in proc.items() if st in statuses}
+    if include_excluded:
+        remove_set |= excl
 
-    import shutil
     from datetime import datetime
     ts = datetime.now().strftime('%Y%m%d-%H%M%S')
 
-    # userids.txt
-    path_ids = 'userids.txt'
-    if os.path.exists(path_ids):
-        shutil.copy2(path_ids, f'{path_ids}.bak-{ts}')
-        out_lines = []
-        with open(path_ids, 'r', encoding='utf-8') as f:
-            for line in f:
-                s=line.strip()
-                if not s:
-                    continue
-                # supports id:hash format
-                key = None
-                if ':' in s:
-                    # user_key uses id part
-                    id_part = s.split(':',1)[0]
-                    if id_part.isdigit():
-                        key = f"id:{id_part}"
-                elif s.isdigit():
-                    key = f'id:{s}'
-                if key is None:
-                    out_lines.append(line)
-                    kept += 1
-                    continue
-                if should_remove(key):
-                    removed += 1
-                else:
-                    out_lines.append(line)
-                    kept += 1
-        with open(path_ids, 'w', encoding='utf-8') as f:
-            f.writelines(out_lines)
-
-    # usernames.txt
-    path_names = 'usernames.txt'
-    if os.path.exists(path_names):
-        shutil.copy2(path_names, f'{path_names}.bak-{ts}')
-        out_lines = []
-        with open(path_names, 'r', encoding='utf-8') as f:
-            for line in f:
-                s=line.strip()
-                if not s:
-                    continue
-                if s.startswith('@'):
-                    s=s[1:]
-                key = f"u:{s.lower()}"
-                if should_remove(key):
-                    removed += 1
-                else:
-                    out_lines.append(line)
-                    kept += 1
-        with open(path_names, 'w', encoding='utf-8') as f:
-            f.writelines(out_lines)
+    def id_key(s: str) -> Optional[str]:
+        # supports id:hash format; user_key uses id part
+        id_part = s.split(':', 1)[0]
+        return f"id:{id_part}" if id_part.isdigit() else None
+
+    def name_key(s: str) -> Optional[str]:
+        if s.startswith('@'):
+            s = s[1:]
+        return f"u:{s.lower()}"
+
+    for path, key_of in (('userids.txt', id_key), ('usernames.txt', name_key)):
+        try:
+            fin = open(path, 'r', encoding='utf-8', buffering=PRUNE_IO_BUFFER)
+        except FileNotFoundError:
+            continue
+        with fin:
+            # backup — настоящая копия, а не hardlink: парсинг дописывает в эти файлы на месте ("ab"),
+            # и при сорвавшейся подмене общий inode испортил бы и .bak
+            _fast_copy(path, f'{path}.bak-{ts}')
+            # потоково во временный файл и атомарная подмена: без списка строк в памяти
+            tmp = path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8', buffering=PRUNE_IO_BUFFER) as fout:
+                for line in fin:
+                    s = line.strip()
+                    if not s:
+                        continue
+                    if key_of(s) in remove_set:
+                        removed += 1
+                    else:
+                        fout.write(line)
+                        kept += 1
+        os.replace(tmp, path)
 
-    conn.close()
     return removed, kept
 
+# -------------------- INVITE OUTCOMES --------------------
+
+# Ошибки инвайта, которые относятся к самому пользователю (а не к сессии/цели):
+# тип -> (status в ledger, reason, причина для excluded_users или None, терминальный ли статус,
+#         ключ счётчика сессии или None, log-функция, сообщение).
+_USER_OUTCOMES: Dict[type, Tuple[str, str, Optional[str], bool, Optional[str], Any, str]] = {
+    UserAlreadyParticipantError: ("already", "уже участник", None, True, None, log_info, "👤 Уже в чате: %s"),
+    UserPrivacyRestrictedError: ("privacy", "закрыты инвайты", "privacy", True, "privacy", log_warn, "🔒 Закрыты инвайты: %s"),
+    UserNotMutualContactError: ("skip", "not_mutual_contact", "not_mutual_contact", False, "not_mutual", log_warn,
+                                "🙅‍♂️ Не взаимный контакт/нельзя инвайтить: %s"),
+    UserChannelsTooMuchError: ("skip", "user_channels_too_much", "user_channels_too_much", False, "user_channels_too_much", log_warn,
+                               "📛 У пользователя слишком много чатов/каналов: %s"),
+    UserKickedError: ("skip", "user_kicked", "user_kicked", False, "user_kicked", log_warn, "🚫 Пользователь кикнут/забанен в цели: %s"),
+    UserBlockedError: ("skip", "user_blocked", "user_blocked", False, "user_blocked", log_warn, "🚫 Пользователь заблокирован/недоступен: %s"),
+    UsernameInvalidError: ("invalid", "некорректный пользователь", "invalid_user", True, "invalid", log_warn, "❌ Невалидный пользователь: %s"),
+    UserIdInvalidError: ("invalid", "некорректный пользователь", "invalid_user", True, "invalid", log_warn, "❌ Невалидный пользователь: %s"),
+    # обычно это значит: по одному user_id не хватает access_hash (Telethon не может резолвить)
+    ValueError: ("skip", "нет access_hash / не могу резолвить по id", "no_access_hash", False, None, log_warn,
+                 "⏭️ Пропуск: не могу инвайтить %s (нужен @username или id:access_hash)."),
+}
+_USER_OUTCOME_TYPES = tuple(_USER_OUTCOMES)
+
+
+def _diag_not_participant(diag: Any) -> bool:
+    """_diagnose_invite_context показал UserNotParticipantError (участник/права)."""
+    return isinstance(diag, dict) and 'UserNotParticipantError' in (diag.get('participant_error'), diag.get('perm_error'))
+
+
+def _apply_user_outcome(
+    conn: sqlite3.Connection,
+    e: BaseException,
+    target_key: str,
+    user_key: str,
+    user_id: Optional[int],
+    username: Optional[str],
+    done: set,
+    excluded_cache: "ExcludedFilter",
+) -> Optional[str]:
+    """Записать исход «пользовательской» ошибки инвайта (ledger, excluded, лог).
+
+    Возвращает ключ счётчика сессии (или None).
+    """
+    # точный тип — один lookup; подклассы (например, ValueError) — по MRO
+    outcome = _USER_OUTCOMES.get(type(e))
+    if outcome is None:
+        outcome = next(_USER_OUTCOMES[c] for c in type(e).__mro__ if c in _USER_OUTCOMES)
+    status, reason, excl_reason, terminal, ses_key, log_fn, msg = outcome
+
+    ledger_put(conn, target_key, user_key, user_id, username, status, reason)
+    if terminal:
+        done.add(user_key)
+    if excl_reason:
+        try:
+            excluded_add(conn, user_key, user_id, username, excl_reason)
+            excluded_cache[user_key] = excl_reason
+        except Exception:
+            pass
+    # построчное ИНФО (уже участник) — только при INVITER_VERBOSE; предупреждения пишем всегда
+    if LOG_VERBOSE or log_fn is not log_info:
+        log_fn(msg, ('@'+username) if username else user_key)
+    return ses_key
+
+
 def inviting_rotate_sessions(
     api_id: int,
     api_hash: str,
     session_files: List[str],
     target: Union[str, int, Any],
-    users: List[Union[str, int]],
+    users: Iterable[Union[str, int]],
     base_delay: float = 2.0,
     switch_on_floodwait_seconds: int = 60,
     rotate_every: int = 0,
@@ -1028,7 +1882,6 @@ def inviting_rotate_sessions(
     # Pro additions (safe defaults)
     jitter_min: float = 0.3,
     jitter_max: float = 1.2,
-    max_user_attempts: int = 3,
     peerflood_freeze_hours: int = 24,
     floodwait_buffer_seconds: int = 60,
     # Night mode
@@ -1036,6 +1889,9 @@ def inviting_rotate_sessions(
     night_start: Tuple[int, int] = (2, 0),
     night_end: Tuple[int, int] = (7, 0),
     night_sleep_jitter: Tuple[float, float] = (30.0, 120.0),
+    # Window-based backoff per session
+    invites_per_minute: int = 20,
+    floodwait_backoff_cap: float = 300.0,
 ) -> None:
     """Invite with smart session orchestration.
 
@@ -1044,7 +1900,8 @@ def inviting_rotate_sessions(
     - fair picking: earliest ready session
     - jittered delays and backoff
     - optional night mode pause window
-    - per-user attempt cap (prevents infinite loops)
+    - each user is tried at most once per run (candidates are deduplicated up front)
+    - per-session window (<= invites_per_minute) + exponential backoff on FloodWait
 
     Existing behavior kept:
     - ledger skip for ok/already/privacy/invalid
@@ -1058,21 +1915,32 @@ def inviting_rotate_sessions(
     target_key = _target_key(target)
 
     # global exclude cache (пользователи с вечными ошибками / уже исключённые)
-    excluded_cache = excluded_load_all(conn)
+    excluded_cache = ExcludedFilter.build(conn)
+    # уже обработанные для этой цели (ok/already/privacy/invalid) — один SELECT на весь прогон
+    done = ledger_load_done(conn, target_key)
 
     delay = max(1.0, float(base_delay))
+    jitter_lo, jitter_hi = float(jitter_min), float(jitter_max)
 
     # session states (persisted)
     st_map = session_stats_load(conn, session_files)
     states = [st_map[sf] for sf in session_files]
 
     state_by_sf = {st.session_file: st for st in states}
+    for st in states:
+        st.backoff = delay
+    session_heap = SessionHeap(states)
 
     # counters
     ok_cnt = 0
     skip_cnt = 0
     fail_cnt = 0
 
+    # когда последний раз сбрасывали dirty-состояния сессий в БД
+    stats_flushed_at = _now()
+    # ближайший момент, когда нужно проверять ночное окно (inf — ночной режим выключен)
+    next_night_check_at = 0.0 if night_mode else float("inf")
+
     # per-session diagnostics counters
     ses_stats: Dict[str, Dict[str, int]] = {sf: {
         "ok": 0,
@@ -1091,347 +1959,290 @@ def inviting_rotate_sessions(
     } for sf in session_files}
 
     # per-session counters for planned rotation/attempt limits
-    ok_in_session = {sf: 0 for sf in session_files}
-    attempts_in_session = {sf: 0 for sf in session_files}
-
-    # per-user attempts in this run
-    user_attempts: Dict[str, int] = {}
-
-    # cache of connected clients (keep it small to reduce reconnect storms)
-    client_cache: Dict[str, TelegramClient] = {}
+    ok_in_session: Counter = Counter()
+    attempts_in_session: Counter = Counter()
+
+    # цель, разрезолвленная в каждой сессии (entity привязан к access_hash конкретного аккаунта);
+    # уже известные по процессу (preflight, прошлый прогон) — сразу из _TARGET_ENTITIES
+    target_ck = _target_cache_key(target)
+    target_entities: Dict[str, Any] = {
+        sf: _TARGET_ENTITIES[(sf, target_ck)] for sf in session_files if (sf, target_ck) in _TARGET_ENTITIES
+    }
+    # _diagnose_invite_context по сессии (цель в прогоне одна)
+    diag_cache: Dict[str, Dict[str, Any]] = {}
     def get_client(sf: str):
-        """Возвращает подключенный client или None, если сессия не авторизована/битая."""
-        c = client_cache.get(sf)
-        if c is not None:
-            return c
+        """Возвращает подключенный client (из общего пула) или None, если сессия не авторизована/битая."""
         try:
-            c = _make_client(sf, api_id, api_hash)
+            return get_pooled_client(sf, api_id, api_hash)
         except RuntimeError as e:
             # Не валим весь прогон из-за одной сессии
-            st = state_by_sf.get(sf)
-            if st:
-                st.banned = True
-                st.fail += 1
-                st.attempts += 1
-                st.next_invite_at = max(st.next_invite_at, _now() + 3600)
-                try:
-                    session_stats_save(conn, st)
-                except Exception:
-                    pass
-            log_warn(f"⚠️ Пропуск сессии {sf}: {e}")
+            # в БД — со следующим invite_state_flush (периодическим или финальным)
+            _penalize_unauthorized(state_by_sf.get(sf), _now())
+            log_warn("⚠️ Пропуск сессии %s: %s", sf, e)
             return None
-        client_cache[sf] = c
-        return c
 
-    def close_all_clients() -> None:
-        for c in list(client_cache.values()):
-            try:
-                c.disconnect()
-            except Exception:
-                pass
-        client_cache.clear()
+    def pick_session(now: float) -> Optional[SessionState]:
+        """Лучшая сессия с учётом soft limits (hour/day).
 
-    log_info(
-        f"🚀 Старт инвайта (PRO) в: {target_key}. Кандидатов: {len(users)}. Сессий: {len(session_files)}"
-    )
-
-    for raw in users:
-        # Night mode pause
-        if night_mode:
-            now = _now()
-            if _is_time_in_window(now, night_start[0], night_start[1], night_end[0], night_end[1]):
-                sec_left = _seconds_until_window_end(now, night_start[0], night_start[1], night_end[0], night_end[1])
-                if sec_left > 0:
-                    log_pause(f"🌙 Ночной режим: пауза до конца окна ({sec_left//60} мин).")
-                    time.sleep(sec_left + random.uniform(*night_sleep_jitter))
-        # normalize user
-        user_key, user_id, username, entity = parse_user_ref(raw)
-
-        # global exclude (вечные отказы/неинвайтабельные)
-        if user_key in excluded_cache:
-            skip_cnt += 1
-            # дополнительно фиксируем в ledger как skip, чтобы было видно в БД
-            try:
-                rsn = excluded_reason(conn, user_key)
-            except Exception:
-                rsn = 'excluded'
-            ledger_put(conn, target_key, user_key, user_id, username, 'skip', f'excluded:{rsn}')
-            continue
-
-
-        prev = ledger_get(conn, target_key, user_key)
-        if prev and prev[0] in ("ok", "already", "privacy", "invalid"):
-            skip_cnt += 1
-            continue
-
-        # cap attempts per user (in this run)
-        user_attempts[user_key] = user_attempts.get(user_key, 0) + 1
-        if max_user_attempts and user_attempts[user_key] > int(max_user_attempts):
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", f"max_attempts={max_user_attempts}")
-            skip_cnt += 1
-            log_warn(f"⏭️ Пропуск (лимит попыток) для {('@'+username) if username else user_key}")
-            continue
-
-        # apply per-session soft limits (hour/day)
-        if per_hour_limit or per_day_limit:
-            for _st in states:
-                due = session_next_time_due_to_limits(_st, per_hour_limit, per_day_limit)
-                if due and due > _now():
-                    _st.next_invite_at = max(_st.next_invite_at, due)
-
-        # pick session
-        st = _pick_best_session(states)
-        if st is None:
-            log_stop("⛔ Нет доступных сессий.")
-            break
-
-        # if all sessions are waiting, sleep until any ready
-        ready_at = max(st.blocked_until, st.frozen_until, st.next_invite_at)
-        if ready_at > _now():
-            _sleep_until_ready(states)
-
-        st = _pick_best_session(states)
-        if st is None:
-            log_stop("⛔ Нет доступных сессий.")
-            break
-
-        sf = st.session_file
-        client = get_client(sf)
-        if client is None:
-            # сессия помечена как невалидная в get_client; пробуем следующую
-            continue
-
-        # jitter before action
-        time.sleep(delay + random.uniform(float(jitter_min), float(jitter_max)))
-
-        # resolve target in this session
+        Лимиты только отодвигают next_invite_at, поэтому проверяем их лениво — у верхушки кучи,
+        а не у всех сессий на каждом пользователе: сдвинули — берём следующую верхушку.
+        """
+        while True:
+            st = session_heap.pick()
+            if st is None or not (per_hour_limit or per_day_limit):
+                return st
+            due = session_next_time_due_to_limits(st, per_hour_limit, per_day_limit)
+            if not due or due <= now or due <= st.next_invite_at:
+                return st
+            st.next_invite_at = due
+
+    def skip_excluded(user_key: str, user_id: Optional[int], username: Optional[str]) -> None:
+        # global exclude (вечные отказы/неинвайтабельные): фиксируем в ledger как skip, чтобы было видно в БД
+        rsn = excluded_cache[user_key] or 'excluded'
+        ledger_put(conn, target_key, user_key, user_id, username, 'skip', f'excluded:{rsn}')
+
+    cand_stats: Counter = Counter()
+    candidates = _iter_candidates(users, done, excluded_cache, cand_stats, skip_excluded)
+    first = next(candidates, None)
+
+    # подключение сессий и резолв цели — параллельно для всех, до первого инвайта
+    if first is not None:
+        candidates = itertools.chain((first,), candidates)
         try:
-            target_entity = client.get_entity(target)
+            target_entities.update(warm_pooled_clients(session_files, api_id, api_hash, target))
         except Exception:
-            target_entity = target
+            pass
 
-        try:
-            st.attempts += 1
-            attempts_in_session[sf] = attempts_in_session.get(sf, 0) + 1
-
-            client(InviteToChannelRequest(channel=target_entity, users=[entity]))
-
-            ledger_put(conn, target_key, user_key, user_id, username, "ok", f"session={sf}")
-            # consume rolling limits
-            session_consume_invite_token(st, per_hour_limit, per_day_limit)
-            ok_cnt += 1
-            st.ok += 1
-            ok_in_session[sf] = ok_in_session.get(sf, 0) + 1
-            st.last_invite_at = _now()
-            st.next_invite_at = st.last_invite_at + max(1.0, delay)
-
-            log_ok(f"✅ Инвайт отправлен: {('@'+username) if username else user_key} → {target_key} | {sf}")
-
-            # gentle adaptive delay
-            delay = min(10.0, max(1.5, delay + random.uniform(-0.15, 0.35)))
-
-            # planned rotation by successes on a session
-            if rotate_every and ok_in_session.get(sf, 0) >= int(rotate_every):
-                ok_in_session[sf] = 0
-                # add a small penalty so other sessions get picked
-                st.next_invite_at = max(st.next_invite_at, _now() + random.uniform(3.0, 8.0))
-
-        except UserAlreadyParticipantError:
-            ledger_put(conn, target_key, user_key, user_id, username, "already", "уже участник")
-            skip_cnt += 1
-            log_info(f"👤 Уже в чате: {('@'+username) if username else user_key}")
-
-        except UserPrivacyRestrictedError:
-            ledger_put(conn, target_key, user_key, user_id, username, "privacy", "закрыты инвайты")
-            try:
-                excluded_add(conn, user_key, user_id, username, "privacy")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            ses_stats[sf]["privacy"] += 1
-            log_warn(f"🔒 Закрыты инвайты: {('@'+username) if username else user_key}")
+    log_info("🚀 Старт инвайта (PRO) в: %s. Сессий: %s", target_key, len(session_files))
 
-        except UserNotMutualContactError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "not_mutual_contact")
-            try:
-                excluded_add(conn, user_key, user_id, username, "not_mutual_contact")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            ses_stats[sf]["not_mutual"] += 1
-            log_warn(f"🙅‍♂️ Не взаимный контакт/нельзя инвайтить: {('@'+username) if username else user_key}")
+    try:
+        for raw, user_key, user_id, username, entity in candidates:
+            # одно время на итерацию; переснимается только после sleep
+            now = _now()
+            # Night mode pause: до начала окна проверка — одно сравнение
+            if now >= next_night_check_at:
+                if _is_time_in_window(now, night_start[0], night_start[1], night_end[0], night_end[1]):
+                    sec_left = _seconds_until_window_end(now, night_start[0], night_start[1], night_end[0], night_end[1])
+                    if sec_left > 0:
+                        log_pause("🌙 Ночной режим: пауза до конца окна (%s мин).", sec_left//60)
+                        time.sleep(sec_left + random.uniform(*night_sleep_jitter))
+                        now = _now()
+                next_night_check_at = _next_window_check_at(now, night_start[0], night_start[1], night_end[0], night_end[1])
+
+            # pick session
+            st = pick_session(now)
+            if st is None:
+                log_stop("⛔ Нет доступных сессий.")
+                break
 
-        except UserChannelsTooMuchError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "user_channels_too_much")
-            try:
-                excluded_add(conn, user_key, user_id, username, "user_channels_too_much")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            ses_stats[sf]["user_channels_too_much"] += 1
-            log_warn(f"📛 У пользователя слишком много чатов/каналов: {('@'+username) if username else user_key}")
+            # if all sessions are waiting, sleep until any ready
+            ready_at = max(st.blocked_until, st.frozen_until, st.next_invite_at)
+            if ready_at > now:
+                # перед долгой паузой ledger и состояние сессий должны быть на диске
+                if ready_at - now >= PACE_QUIET_SEC:
+                    try:
+                        invite_state_flush(conn, states)
+                    except Exception:
+                        pass
+                    stats_flushed_at = now
+                _sleep_until_ready(states)
+                now = _now()
+
+            st = pick_session(now)
+            if st is None:
+                log_stop("⛔ Нет доступных сессий.")
+                break
 
-        except UserKickedError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "user_kicked")
-            try:
-                excluded_add(conn, user_key, user_id, username, "user_kicked")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            ses_stats[sf]["user_kicked"] += 1
-            log_warn(f"🚫 Пользователь кикнут/забанен в цели: {('@'+username) if username else user_key}")
+            sf = st.session_file
+            client = get_client(sf)
+            if client is None:
+                # сессия помечена как невалидная в get_client; пробуем следующую
+                continue
 
-        except UserBlockedError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "user_blocked")
-            try:
-                excluded_add(conn, user_key, user_id, username, "user_blocked")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            ses_stats[sf]["user_blocked"] += 1
-            log_warn(f"🚫 Пользователь заблокирован/недоступен: {('@'+username) if username else user_key}")
+            # resolve target in this session (один раз на сессию, а не на каждого пользователя)
+            target_entity = target_entities.get(sf)
+            if target_entity is None:
+                try:
+                    target_entity = _TARGET_ENTITIES[(sf, target_ck)] = client.get_input_entity(target)
+                except Exception:
+                    # не резолвится в этой сессии — не повторяем RPC на каждом пользователе
+                    target_entity = target
+                target_entities[sf] = target_entity
 
-        except ChatWriteForbiddenError as e:
-            # Обычно означает ограничение/запрет на стороне ИМЕННО этой сессии в цели.
-            diag = _diagnose_invite_context(client, target_entity)
             try:
-                if isinstance(diag, dict) and (diag.get('participant_error') == 'UserNotParticipantError' or diag.get('perm_error') == 'UserNotParticipantError'):
-                    excluded_add(conn, user_key, user_id, username, 'user_not_participant')
-                    excluded_cache.add(user_key)
-            except Exception:
-                pass
-            try:
-                if str(diag.get('participant_error') or '') == 'UserNotParticipantError':
-                    excluded_add(conn, user_key, user_id, username, 'user_not_participant')
-                    excluded_cache.add(user_key)
-            except Exception:
-                pass
-            ledger_put(conn, target_key, user_key, user_id, username, "forbidden", f"{type(e).__name__}")
-            st.fail += 1
-            fail_cnt += 1
-
-            # Не долбим эту сессию — отложим на 7 дней (можно поменять позже)
-            st.blocked_until = max(st.blocked_until, _now() + 7 * 24 * 3600)
-            log_warn(
-                f"🚫 ChatWriteForbidden на {sf} при инвайте {('@'+username) if username else user_key} → {target_key}. "
-                f"Диагностика: {diag}"
-            )
+                st.attempts += 1
+                attempts_in_session[sf] += 1
+
+                client(InviteToChannelRequest(channel=target_entity, users=[entity]))
+
+                ledger_put(conn, target_key, user_key, user_id, username, "ok", f"session={sf}")
+                done.add(user_key)
+                # consume rolling limits
+                session_consume_invite_token(st, per_hour_limit, per_day_limit)
+                ok_cnt += 1
+                st.ok += 1
+                ok_in_session[sf] += 1
+                st.last_invite_at = now
+                # успех — backoff сессии плавно возвращается к базовой задержке
+                st.backoff = max(delay, st.backoff / 2)
+                window_due = session_window_push(st, st.last_invite_at, invites_per_minute)
+                if window_due:
+                    st.next_invite_at = max(st.next_invite_at, window_due)
+
+                if LOG_VERBOSE:
+                    log_ok("✅ Инвайт отправлен: %s → %s | %s", ('@'+username) if username else user_key, target_key, sf)
+
+                # planned rotation by successes on a session
+                if rotate_every and ok_in_session[sf] >= int(rotate_every):
+                    ok_in_session[sf] = 0
+                    # add a small penalty so other sessions get picked
+                    st.next_invite_at = max(st.next_invite_at, now + random.uniform(3.0, 8.0))
+
+            except _USER_OUTCOME_TYPES as e:
+                ses_key = _apply_user_outcome(conn, e, target_key, user_key, user_id, username, done, excluded_cache)
+                skip_cnt += 1
+                if ses_key:
+                    ses_stats[sf][ses_key] += 1
+
+            except ChatWriteForbiddenError as e:
+                # Обычно означает ограничение/запрет на стороне ИМЕННО этой сессии в цели.
+                # Диагностика — до 3 RPC; для пары (сессия, цель) результат не меняется, делаем один раз.
+                diag = diag_cache.get(sf)
+                if diag is None:
+                    diag = diag_cache[sf] = _diagnose_invite_context(client, target_entity)
+                # доступ сессии к цели мог измениться — после паузы резолвим заново
+                target_entities.pop(sf, None)
+                _TARGET_ENTITIES.pop((sf, target_ck), None)
+                if _diag_not_participant(diag):
+                    try:
+                        excluded_add(conn, user_key, user_id, username, 'user_not_participant')
+                        excluded_cache[user_key] = 'user_not_participant'
+                    except Exception:
+                        pass
+                ledger_put(conn, target_key, user_key, user_id, username, "forbidden", f"{type(e).__name__}")
+                st.fail += 1
+                fail_cnt += 1
 
-        except FloodWaitError as e:
-            sec = int(getattr(e, "seconds", 0) or 0)
-            ledger_put(conn, target_key, user_key, user_id, username, "floodwait", f"{sec}")
+                # Не долбим эту сессию — отложим на 7 дней (можно поменять позже)
+                st.blocked_until = max(st.blocked_until, now + 7 * 24 * 3600)
+                log_warn(
+                    "🚫 ChatWriteForbidden на %s при инвайте %s → %s. Диагностика: %s",
+                    sf, ('@'+username) if username else user_key, target_key, diag,
+                )
 
-            st.fail += 1
-            fail_cnt += 1
+            except FloodWaitError as e:
+                sec = int(getattr(e, "seconds", 0) or 0)
+                ledger_put(conn, target_key, user_key, user_id, username, "floodwait", f"{sec}")
 
-            # block this session for wait + buffer
-            st.blocked_until = max(st.blocked_until, _now() + sec + int(floodwait_buffer_seconds))
+                st.fail += 1
+                fail_cnt += 1
 
-            if sec > int(switch_on_floodwait_seconds):
-                log_pause(f"💤 FloodWait {sec}s (>{switch_on_floodwait_seconds}). Блокирую {sf} и продолжаю другой сессией…")
-            else:
-                log_pause(f"💤 FloodWait {sec}s. Блокирую {sf} и продолжаю…")
+                # block this session for wait + buffer + экспоненциальный backoff с джиттером
+                st.backoff = min(float(floodwait_backoff_cap), max(delay, st.backoff) * 2)
+                backoff = st.backoff + random.uniform(0.0, st.backoff / 4)
+                st.blocked_until = max(st.blocked_until, now + sec + int(floodwait_buffer_seconds) + backoff)
 
-            # backoff for global delay
-            delay = min(15.0, max(delay, 6.0))
+                if sec > int(switch_on_floodwait_seconds):
+                    log_pause("💤 FloodWait %ss (>%s). Блокирую %s и продолжаю другой сессией…", sec, switch_on_floodwait_seconds, sf)
+                else:
+                    log_pause("💤 FloodWait %ss. Блокирую %s и продолжаю…", sec, sf)
 
-        except (UsernameInvalidError, UserIdInvalidError):
-            ledger_put(conn, target_key, user_key, user_id, username, "invalid", "некорректный пользователь")
-            try:
-                excluded_add(conn, user_key, user_id, username, "invalid_user")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            ses_stats[sf]["invalid"] += 1
-            log_warn(f"❌ Невалидный пользователь: {raw}")
-
-        except ChatAdminRequiredError:
-            ledger_put(conn, target_key, user_key, user_id, username, "stop", "нет прав на инвайт")
-            log_stop(f"⛔ Нет прав на инвайт в {target_key}. Останавливаю прогон.")
-            break
-
-        except PeerFloodError:
-            ledger_put(conn, target_key, user_key, user_id, username, "peerflood", "PeerFlood/лимит на аккаунте")
-            st.fail += 1
-            fail_cnt += 1
-            # freeze session for long time
-            freeze_sec = int(peerflood_freeze_hours) * 3600
-            st.frozen_until = max(st.frozen_until, _now() + freeze_sec)
-            log_stop(f"⛔ PeerFlood на {sf}: замораживаю на {peerflood_freeze_hours}ч и продолжаю другой сессией.")
-        except ValueError:
-            # Обычно это значит: по одному user_id не хватает access_hash (Telethon не может резолвить)
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "нет access_hash / не могу резолвить по id")
-            try:
-                excluded_add(conn, user_key, user_id, username, "no_access_hash")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            log_warn(f"⏭️ Пропуск: не могу инвайтить {raw} (нужен @username или id:access_hash).")
-
-        except (ConnectionResetError, ConnectionError, OSError) as e:
-            # Сетевой сбой/ресет соединения — не вина пользователя.
-            st.fail += 1
-            fail_cnt += 1
-            st.blocked_until = max(st.blocked_until, _now() + 60)
-            log_warn(f"🌐 Сеть/соединение для {sf}: {type(e).__name__}. Пауза 60с и продолжаю другой сессией…")
-            try:
-                client.disconnect()
-            except Exception:
-                pass
+            except ChatAdminRequiredError:
+                ledger_put(conn, target_key, user_key, user_id, username, "stop", "нет прав на инвайт")
+                log_stop("⛔ Нет прав на инвайт в %s. Останавливаю прогон.", target_key)
+                break
 
-        except RPCError as e:
-            ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
-            st.fail += 1
-            fail_cnt += 1
-            log_warn(f"⚠️ Ошибка RPC ({type(e).__name__}) для {raw}")
+            except PeerFloodError:
+                ledger_put(conn, target_key, user_key, user_id, username, "peerflood", "PeerFlood/лимит на аккаунте")
+                st.fail += 1
+                fail_cnt += 1
+                # freeze session for long time
+                freeze_sec = int(peerflood_freeze_hours) * 3600
+                st.frozen_until = max(st.frozen_until, now + freeze_sec)
+                log_stop("⛔ PeerFlood на %s: замораживаю на %sч и продолжаю другой сессией.", sf, peerflood_freeze_hours)
+            except UnauthorizedError as e:
+                # авторизация сессии слетела (ключ отозван, аккаунт удалён) — не вина пользователя
+                st.banned = True
+                st.fail += 1
+                fail_cnt += 1
+                drop_pooled_client(sf)
+                log_warn("⚠️ Сессия %s больше не авторизована (%s) — убираю из ротации.", sf, type(e).__name__)
 
-        except Exception as e:
-            ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
-            st.fail += 1
-            fail_cnt += 1
-            log_warn(f"⚠️ Неизвестная ошибка ({type(e).__name__}) для {raw}")
+            except (ConnectionResetError, ConnectionError, OSError) as e:
+                # Сетевой сбой/ресет соединения — не вина пользователя.
+                st.fail += 1
+                fail_cnt += 1
+                st.blocked_until = max(st.blocked_until, now + 60)
+                log_warn("🌐 Сеть/соединение для %s: %s. Пауза 60с и продолжаю другой сессией…", sf, type(e).__name__)
+                try:
+                    client.disconnect()
+                except Exception:
+                    pass
 
-        # persist session state
-        try:
-            session_stats_save(conn, st)
-        except Exception:
-            pass
+            except RPCError as e:
+                ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
+                st.fail += 1
+                fail_cnt += 1
+                log_warn("⚠️ Ошибка RPC (%s) для %s", type(e).__name__, raw)
 
-        # per-session attempt cap (if enabled)
-        if max_attempts_per_session and attempts_in_session.get(sf, 0) >= int(max_attempts_per_session):
-            attempts_in_session[sf] = 0
-            st.next_invite_at = max(st.next_invite_at, _now() + random.uniform(10.0, 25.0))
-            log_info(f"🔁 Лимит попыток на {sf}: делаю паузу для этой сессии.")
+            except Exception as e:
+                ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
+                st.fail += 1
+                fail_cnt += 1
+                log_warn("⚠️ Неизвестная ошибка (%s) для %s", type(e).__name__, raw)
+
+            # темп — в расписании самой сессии (backoff + jitter), а не общим sleep перед каждым инвайтом:
+            # пока эта сессия ждёт, следующего пользователя берёт другая готовая
+            st.next_invite_at = max(st.next_invite_at, now + max(1.0, st.backoff) + random.uniform(jitter_lo, jitter_hi))
+
+            # per-session attempt cap (if enabled)
+            if max_attempts_per_session and attempts_in_session[sf] >= int(max_attempts_per_session):
+                attempts_in_session[sf] = 0
+                st.next_invite_at = max(st.next_invite_at, now + random.uniform(10.0, 25.0))
+                log_info("🔁 Лимит попыток на %s: делаю паузу для этой сессии.", sf)
+
+            # persist session state: помечаем и сбрасываем вместе с буфером ledger раз в SESSION_STATS_FLUSH_SEC
+            st.dirty = True
+            if now - stats_flushed_at >= SESSION_STATS_FLUSH_SEC:
+                try:
+                    invite_state_flush(conn, states)
+                except Exception:
+                    pass
+                stats_flushed_at = now
+    finally:
+        # дописываем хвост буфера ledger и состояния сессий даже при Ctrl+C/ошибке
+        invite_state_flush(conn, states)
 
-    log_ok(f"🏁 Инвайт завершён. Успех: {ok_cnt}, пропуск: {skip_cnt}, ошибки: {fail_cnt}")
+    skip_cnt += cand_stats["skipped"]
+    log_ok(
+        "🏁 Инвайт завершён. Пользователей: %s. Успех: %s, пропуск: %s, ошибки: %s",
+        cand_stats["total"], ok_cnt, skip_cnt, fail_cnt,
+    )
 
     # Session summary (helps to understand why some accounts fail)
     try:
         for sf in session_files:
             s = ses_stats.get(sf) or {}
             log_info(
-                f"📊 Итоги сессии {sf}: "
-                f"ok={s.get('ok',0)} forbidden={s.get('forbidden',0)} privacy={s.get('privacy',0)} "
-                f"not_mutual={s.get('not_mutual',0)} user_blocked={s.get('user_blocked',0)} user_kicked={s.get('user_kicked',0)} "
-                f"user_channels_too_much={s.get('user_channels_too_much',0)} "
-                f"floodwait={s.get('floodwait',0)} peerflood={s.get('peerflood',0)} network={s.get('network',0)} "
-                f"invalid={s.get('invalid',0)} rpc_other={s.get('rpc_other',0)} other={s.get('other',0)}"
+                "📊 Итоги сессии %s: "
+                "ok=%s forbidden=%s privacy=%s "
+                "not_mutual=%s user_blocked=%s user_kicked=%s "
+                "user_channels_too_much=%s "
+                "floodwait=%s peerflood=%s network=%s "
+                "invalid=%s rpc_other=%s other=%s",
+                sf,
+                s.get('ok',0), s.get('forbidden',0), s.get('privacy',0),
+                s.get('not_mutual',0), s.get('user_blocked',0), s.get('user_kicked',0),
+                s.get('user_channels_too_much',0),
+                s.get('floodwait',0), s.get('peerflood',0), s.get('network',0),
+                s.get('invalid',0), s.get('rpc_other',0), s.get('other',0),
             )
     except Exception:
         pass
-    close_all_clients()
-    conn.close()
+    log_flush()
 
 
-
-def inviting(client: TelegramClient, target: Union[str, int, Any], users: List[Union[str, int]], base_delay: float = 2.0) -> None:
+def inviting(client: TelegramClient, target: Union[str, int, Any], users: Iterable[Union[str, int]], base_delay: float = 2.0) -> None:
     """Инвайт одним клиентом (1 сессия).
 
     - учитывает ledger (не трогает уже обработанных для этой цели)
@@ -1439,177 +2250,172 @@ def inviting(client: TelegramClient, target: Union[str, int, Any], users: List[U
     """
     conn = _db()
     target_key = _target_key(target)
-    excluded_cache = excluded_load_all(conn)
+    excluded_cache = ExcludedFilter.build(conn)
+    done = ledger_load_done(conn, target_key)
+
+    cand_stats: Counter = Counter()
+    candidates = _iter_candidates(users, done, excluded_cache, cand_stats)
 
-    log_info(f"🚀 Старт инвайта в: {target_key}. Кандидатов: {len(users)}")
+    log_info("🚀 Старт инвайта в: %s", target_key)
     ok_cnt = 0
     skip_cnt = 0
     fail_cnt = 0
 
-    delay = max(1.0, float(base_delay))
+    # темп: старт с 1/base_delay, потолок — не чаще одного инвайта в 1.5с
+    bucket = TokenBucket(rate=1.0 / max(1.0, float(base_delay)), max_rate=1.0 / 1.5)
 
-    # resolve target once (по возможности)
+    # resolve target once (по возможности); InputPeer — из кеша .session без сети, если цель уже известна
     try:
-        target_entity = client.get_entity(target)
+        target_entity = client.get_input_entity(target)
     except Exception:
         target_entity = target
+    diag: Optional[Dict[str, Any]] = None
 
-    for raw in users:
-        user_key, user_id, username, entity = parse_user_ref(raw)
-
-        if user_key in excluded_cache:
-            skip_cnt += 1
-            continue
-
-        prev = ledger_get(conn, target_key, user_key)
-        if prev and prev[0] in ("ok", "already", "privacy", "invalid"):
-            skip_cnt += 1
-            continue
-
-        time.sleep(delay + random.uniform(0.3, 1.2))
-
-        try:
-            client(InviteToChannelRequest(channel=target_entity, users=[entity]))
-            ledger_put(conn, target_key, user_key, user_id, username, "ok", "ok")
-            ok_cnt += 1
-            log_ok(f"✅ Инвайт отправлен: {('@'+username) if username else user_key} → {target_key}")
-            delay = min(8.0, max(1.5, delay + random.uniform(-0.2, 0.4)))
-
-        except UserAlreadyParticipantError:
-            ledger_put(conn, target_key, user_key, user_id, username, "already", "уже участник")
-            skip_cnt += 1
-            log_info(f"👤 Уже в чате: {('@'+username) if username else user_key}")
-
-        except UserPrivacyRestrictedError:
-            ledger_put(conn, target_key, user_key, user_id, username, "privacy", "закрыты инвайты")
-            try:
-                excluded_add(conn, user_key, user_id, username, "privacy")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            log_warn(f"🔒 Закрыты инвайты: {('@'+username) if username else user_key}")
-
-        except UserNotMutualContactError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "not_mutual_contact")
-            try:
-                excluded_add(conn, user_key, user_id, username, "not_mutual_contact")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            log_warn(f"🙅‍♂️ Не взаимный контакт/нельзя инвайтить: {('@'+username) if username else user_key}")
-
-        except UserChannelsTooMuchError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "user_channels_too_much")
-            try:
-                excluded_add(conn, user_key, user_id, username, "user_channels_too_much")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            log_warn(f"📛 У пользователя слишком много чатов/каналов: {('@'+username) if username else user_key}")
+    try:
+        for raw, user_key, user_id, username, entity in candidates:
+            bucket.acquire()
+            time.sleep(random.uniform(0.3, 1.2))
 
-        except UserKickedError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "user_kicked")
             try:
-                excluded_add(conn, user_key, user_id, username, "user_kicked")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            log_warn(f"🚫 Пользователь кикнут/забанен в цели: {('@'+username) if username else user_key}")
+                client(InviteToChannelRequest(channel=target_entity, users=[entity]))
+                ledger_put(conn, target_key, user_key, user_id, username, "ok", "ok")
+                done.add(user_key)
+                ok_cnt += 1
+                if LOG_VERBOSE:
+                    log_ok("✅ Инвайт отправлен: %s → %s", ('@'+username) if username else user_key, target_key)
+                bucket.on_success()
+
+            except _USER_OUTCOME_TYPES as e:
+                _apply_user_outcome(conn, e, target_key, user_key, user_id, username, done, excluded_cache)
+                skip_cnt += 1
+
+            except ChatWriteForbiddenError as e:
+                # одна сессия и одна цель — диагностика (до 3 RPC) не меняется, делаем её один раз
+                if diag is None:
+                    diag = _diagnose_invite_context(client, target_entity)
+                if _diag_not_participant(diag):
+                    try:
+                        excluded_add(conn, user_key, user_id, username, 'user_not_participant')
+                        excluded_cache[user_key] = 'user_not_participant'
+                    except Exception:
+                        pass
+                ledger_put(conn, target_key, user_key, user_id, username, "forbidden", f"{type(e).__name__}")
+                fail_cnt += 1
+                log_warn("🚫 ChatWriteForbidden при инвайте %s → %s. Диагностика: %s", ('@'+username) if username else user_key, target_key, diag)
+
+            except FloodWaitError as e:
+                sec = int(getattr(e, "seconds", 0) or 0)
+                ledger_put(conn, target_key, user_key, user_id, username, "floodwait", f"{sec}")
+                log_pause("💤 FloodWait %s сек. Ожидаю и продолжаю…", sec)
+                # перед ожиданием буфер ledger — на диск: во сне сброс по возрасту не сработает
+                try:
+                    ledger_flush(conn)
+                except Exception:
+                    pass
+                time.sleep(sec + random.uniform(1.0, 3.0))
+                bucket.on_flood()
+                fail_cnt += 1
 
-        except UserBlockedError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "user_blocked")
-            try:
-                excluded_add(conn, user_key, user_id, username, "user_blocked")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            log_warn(f"🚫 Пользователь заблокирован/недоступен: {('@'+username) if username else user_key}")
+            except ChatAdminRequiredError:
+                ledger_put(conn, target_key, user_key, user_id, username, "stop", "нет прав на инвайт")
+                log_stop("⛔ Нет прав на инвайт в %s. Останавливаю прогон.", target_key)
+                break
 
-        except ChatWriteForbiddenError as e:
-            diag = _diagnose_invite_context(client, target_entity)
-            try:
-                if isinstance(diag, dict) and (diag.get('participant_error') == 'UserNotParticipantError' or diag.get('perm_error') == 'UserNotParticipantError'):
-                    excluded_add(conn, user_key, user_id, username, 'user_not_participant')
-                    excluded_cache.add(user_key)
-            except Exception:
-                pass
-            ledger_put(conn, target_key, user_key, user_id, username, "forbidden", f"{type(e).__name__}")
-            fail_cnt += 1
-            log_warn(f"🚫 ChatWriteForbidden при инвайте {('@'+username) if username else user_key} → {target_key}. Диагностика: {diag}")
-
-        except FloodWaitError as e:
-            sec = int(getattr(e, "seconds", 0) or 0)
-            ledger_put(conn, target_key, user_key, user_id, username, "floodwait", f"{sec}")
-            log_pause(f"💤 FloodWait {sec} сек. Ожидаю и продолжаю…")
-            time.sleep(sec + random.uniform(1.0, 3.0))
-            delay = min(12.0, max(delay, 6.0))
-            fail_cnt += 1
-
-        except (UsernameInvalidError, UserIdInvalidError):
-            ledger_put(conn, target_key, user_key, user_id, username, "invalid", "некорректный пользователь")
-            try:
-                excluded_add(conn, user_key, user_id, username, "invalid_user")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            log_warn(f"❌ Невалидный пользователь: {raw}")
+            except PeerFloodError:
+                ledger_put(conn, target_key, user_key, user_id, username, "peerflood", "PeerFlood/лимит на аккаунте")
+                log_stop("⛔ PeerFlood: аккаунт под лимитом/подозрением. Останавливаю прогон, чтобы не улететь в бан.")
+                break
 
-        except ChatAdminRequiredError:
-            ledger_put(conn, target_key, user_key, user_id, username, "stop", "нет прав на инвайт")
-            log_stop(f"⛔ Нет прав на инвайт в {target_key}. Останавливаю прогон.")
-            break
+            except (ConnectionResetError, ConnectionError, OSError) as e:
+                ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
+                fail_cnt += 1
+                log_warn("🌐 Сеть/соединение: %s. Пауза 30с и продолжаю…", type(e).__name__)
+                time.sleep(30)
+
+            except RPCError as e:
+                ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
+                fail_cnt += 1
+                log_warn("⚠️ Ошибка RPC (%s) для %s", type(e).__name__, raw)
+
+            except Exception as e:
+                ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
+                fail_cnt += 1
+                log_warn("⚠️ Неизвестная ошибка (%s) для %s", type(e).__name__, raw)
+    finally:
+        # дописываем хвост буфера ledger даже при Ctrl+C/ошибке
+        ledger_flush(conn)
+
+    skip_cnt += cand_stats["skipped"]
+    log_ok(
+        "🏁 Инвайт завершён. Пользователей: %s. Успех: %s, пропуск: %s, ошибки: %s",
+        cand_stats["total"], ok_cnt, skip_cnt, fail_cnt,
+    )
+    log_flush()
 
-        except PeerFloodError:
-            ledger_put(conn, target_key, user_key, user_id, username, "peerflood", "PeerFlood/лимит на аккаунте")
-            log_stop("⛔ PeerFlood: аккаунт под лимитом/подозрением. Останавливаю прогон, чтобы не улететь в бан.")
-            break
+# -------------------- CONFIG UI --------------------
 
-        except ValueError:
-            ledger_put(conn, target_key, user_key, user_id, username, "skip", "нет access_hash / не могу резолвить по id")
-            try:
-                excluded_add(conn, user_key, user_id, username, "no_access_hash")
-                excluded_cache.add(user_key)
-            except Exception:
-                pass
-            skip_cnt += 1
-            log_warn(f"⏭️ Пропуск: не могу инвайтить {raw} (нужен @username или id:access_hash).")
+def _list_sessions() -> List[str]:
+    return list_session_files()
 
-        except (ConnectionResetError, ConnectionError, OSError) as e:
-            ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
-            fail_cnt += 1
-            log_warn(f"🌐 Сеть/соединение: {type(e).__name__}. Пауза 30с и продолжаю…")
-            time.sleep(30)
+def _enable_windows_vt() -> bool:
+    """Включить обработку ANSI (VT) в консоли Windows 10+; False — старая консоль или вывод не в консоль."""
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        return bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))
+    except Exception:
+        return False
 
-        except RPCError as e:
-            ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
-            fail_cnt += 1
-            log_warn(f"⚠️ Ошибка RPC ({type(e).__name__}) для {raw}")
 
-        except Exception as e:
-            ledger_put(conn, target_key, user_key, user_id, username, "failed", f"{type(e).__name__}")
-            fail_cnt += 1
-            log_warn(f"⚠️ Неизвестная ошибка ({type(e).__name__}) для {raw}")
+# очистка экрана меню: платформа и TTY проверяются один раз при импорте.
+# ANSI-последовательность — без запуска shell; cls — только если VT в консоли Windows не включился;
+# в pipe/файл ничего не пишем.
+if os.name == "nt" and not _enable_windows_vt():
+    def clear_screen() -> None:
+        os.system("cls")
+elif sys.stdout is not None and sys.stdout.isatty():
+    def clear_screen() -> None:
+        sys.stdout.write("\x1b[H\x1b[2J\x1b[3J")
+        sys.stdout.flush()
+else:
+    def clear_screen() -> None:
+        pass
 
-    log_ok(f"🏁 Инвайт завершён. Успех: {ok_cnt}, пропуск: {skip_cnt}, ошибки: {fail_cnt}")
-    conn.close()
 
-# -------------------- CONFIG UI --------------------
+def ui_pause(sec: float) -> None:
+    """Пауза после сообщения в меню: sec секунд или до нажатия Enter — что раньше."""
+    if os.name == "nt":
+        import msvcrt
+        end = time.monotonic() + sec
+        while time.monotonic() < end:
+            if msvcrt.kbhit():
+                msvcrt.getwch()
+                return
+            time.sleep(0.05)
+        return
+    import select
+    try:
+        ready, _, _ = select.select([sys.stdin], [], [], sec)
+    except (OSError, ValueError):
+        # stdin не терминал/закрыт — обычная пауза
+        time.sleep(sec)
+        return
+    if ready:
+        # съедаем Enter, чтобы он не ушёл в следующий input()
+        sys.stdin.readline()
 
-def _list_sessions() -> List[str]:
-    return list_session_files()
 
 def _create_account_session(api_id: int, api_hash: str) -> None:
-    os.system("cls||clear")
+    clear_screen()
     phone = input("Введите номер телефона аккаунта (формат +79991234567): ").strip()
     if not phone:
         print("Пустой номер.")
-        time.sleep(1.5)
+        ui_pause(1.5)
         return
 
     # ВАЖНО: session = path/name (БЕЗ .session). Telethon создаст sessoins/<phone>.session
@@ -1628,117 +2434,209 @@ def _create_account_session(api_id: int, api_hash: str) -> None:
     client.start(phone=phone)
     client.disconnect()
 
-    log_ok(f"📲 Аккаунт добавлен: {phone}.session (папка {SESSIONS_DIR}/)")
+    log_ok("📲 Аккаунт добавлен: %s.session (папка %s/)", phone, SESSIONS_DIR)
     print("Готово. Сессия создана.")
-    time.sleep(1.5)
+    ui_pause(1.5)
+
+def _cfg_set_api_id(options: Options) -> bool:
+    clear_screen()
+    raw = input("Введите API_ID: ").strip()
+    if not raw.isdigit():
+        print("API_ID должен быть числом.")
+        ui_pause(1.8)
+        return False
+    changed = int(raw) != options.api_id
+    options.api_id = int(raw)
+    return changed
+
+
+def _cfg_set_api_hash(options: Options) -> bool:
+    clear_screen()
+    val = input("Введите API_HASH: ").strip()
+    changed = val != options.api_hash
+    options.api_hash = val
+    return changed
+
+
+def _cfg_toggle(options: Options, name: str) -> bool:
+    setattr(options, name, not getattr(options, name))
+    return True
+
+
+def _cfg_add_account(options: Options) -> bool:
+    # создать новую сессию (options.txt не меняется)
+    if not options.has_api:
+        print("Сначала задайте API_ID и API_HASH.")
+        ui_pause(1.8)
+        return False
+    _create_account_session(options.api_id, options.api_hash)
+    return False
+
+
+def _cfg_reset(options: Options) -> bool:
+    clear_screen()
+    answer = input("Сбросить API_ID/API_HASH и опции парсинга?\n1 - Да\n2 - Нет\nВвод: ").strip()
+    defaults = Options()
+    if answer != "1" or options == defaults:
+        return False
+    for f in dataclasses.fields(Options):
+        setattr(options, f.name, getattr(defaults, f.name))
+    return True
+
+
+# пункт меню -> обработчик(options) -> изменились ли настройки
+_CONFIG_ACTIONS: Dict[str, Any] = {
+    "1": _cfg_set_api_id,
+    "2": _cfg_set_api_hash,
+    "3": lambda o: _cfg_toggle(o, "parse_id"),
+    "4": lambda o: _cfg_toggle(o, "parse_name"),
+    "5": _cfg_add_account,
+    "6": _cfg_reset,
+}
+
 
 def config() -> None:
-    ensure_options()
-    while True:
-        os.system("cls||clear")
-        options = getoptions()
-        sessions = _list_sessions()
-
-        print("=== НАСТРОЙКИ ===")
-        print(f"1 - Обновить api_id   [{options[0].strip()}]")
-        print(f"2 - Обновить api_hash [{options[1].strip()}]")
-        print(f"3 - Парсить user-id   [{options[2].strip()}]")
-        print(f"4 - Парсить user-name [{options[3].strip()}]")
-        print(f"5 - Добавить аккаунт  [{len(sessions)}]")
-        print("6 - Сбросить настройки")
-        print("e - Выход")
-        key = input("Ввод: ").strip()
-
-        if key == "1":
-            os.system("cls||clear")
-            options[0] = input("Введите API_ID: ").strip() + "\n"
-        elif key == "2":
-            os.system("cls||clear")
-            options[1] = input("Введите API_HASH: ").strip() + "\n"
-        elif key == "3":
-            options[2] = "False\n" if options[2].strip() == "True" else "True\n"
-        elif key == "4":
-            options[3] = "False\n" if options[3].strip() == "True" else "True\n"
-        elif key == "5":
-            # создать новую сессию
-            if options[0].strip() in ("NONEID", "") or options[1].strip() in ("NONEHASH", ""):
-                print("Сначала задайте API_ID и API_HASH.")
-                time.sleep(1.8)
-                continue
-            try:
-                api_id = int(options[0].strip())
-            except Exception:
-                print("API_ID должен быть числом.")
-                time.sleep(1.8)
+    options = getoptions()
+    changed = False
+    try:
+        while True:
+            clear_screen()
+            sessions = _list_sessions()
+
+            print("=== НАСТРОЙКИ ===")
+            print(f"1 - Обновить api_id   [{'NONEID' if options.api_id is None else options.api_id}]")
+            print(f"2 - Обновить api_hash [{options.api_hash or 'NONEHASH'}]")
+            print(f"3 - Парсить user-id   [{options.parse_id}]")
+            print(f"4 - Парсить user-name [{options.parse_name}]")
+            print(f"5 - Добавить аккаунт  [{len(sessions)}]")
+            print("6 - Сбросить настройки")
+            print("e - Выход")
+            key = input("Ввод: ").strip()
+
+            if key.lower() == "e":
+                break
+            action = _CONFIG_ACTIONS.get(key)
+            if action is None:
+                print("Неверный пункт.")
+                ui_pause(1.0)
                 continue
-            _create_account_session(api_id, options[1].strip())
-        elif key == "6":
-            os.system("cls||clear")
-            answer = input("Сбросить API_ID/API_HASH и опции парсинга?\n1 - Да\n2 - Нет\nВвод: ").strip()
-            if answer == "1":
-                options = DEFAULT_OPTIONS.copy()
-        elif key.lower() == "e":
-            break
-        else:
-            print("Неверный пункт.")
-            time.sleep(1.0)
-            continue
 
-        # сохраняем изменения настроек
-        with open("options.txt", "w", encoding="utf-8") as f:
-            f.writelines(options)
+            # правки копятся в options, файл пишется один раз при выходе из меню
+            if action(options):
+                changed = True
 
-        # небольшая пауза, чтобы меню не "мигало"
-        time.sleep(0.2)
+            # небольшая пауза, чтобы меню не "мигало"
+            ui_pause(0.2)
+    finally:
+        if changed:
+            saveoptions(options)
 
 
+# -------------------- PRE-FLIGHT (PRO) --------------------
 
+# исключение -> причина для preflight; порядок важен (первое совпадение)
+_ENSURE_EXC_MAP: Tuple[Tuple[Any, str], ...] = (
+    (FloodWaitError, "flood_wait"),
+    (ChannelPrivateError, "channel_private"),
+    (UserBannedInChannelError, "banned_in_channel"),
+    ((OSError, ConnectionError), "network"),
+    (UnauthorizedError, "not_authorized"),
+)
 
-# -------------------- PRE-FLIGHT (PRO) --------------------
 
-def _ensure_in_target(client: TelegramClient, target_entity, auto_join: bool = True) -> Tuple[bool, str]:
+def _classify_ensure_exc(exc: BaseException, fallback: Optional[str] = None) -> str:
+    """Причина по исключению; для прочих — fallback, либо rpc_<Имя> / unknown."""
+    for cls, reason in _ENSURE_EXC_MAP:
+        if isinstance(exc, cls):
+            return reason
+    if fallback is not None:
+        return fallback
+    if isinstance(exc, RPCError):
+        # give caller a hint what exactly happened
+        return f"rpc_{exc.__class__.__name__}"
+    return "unknown"
+
+
+async def _ensure_in_target_async(client: TelegramClient, target_entity, auto_join: bool = True) -> Tuple[bool, str]:
     """Return (ok, reason).
 
     Reasons:
-      ok | joined | cannot_join | channel_private | banned_in_channel | flood_wait | network | unknown
+      ok | joined | not_participant | cannot_join | channel_private | banned_in_channel
+      | flood_wait | network | not_authorized | rpc_<Error> | unknown
     """
     try:
-        me = client.get_me()
-        client(GetParticipantRequest(channel=target_entity, participant=me))
+        me = await client.get_me()
+        await client(GetParticipantRequest(channel=target_entity, participant=me))
         return True, "ok"
     except UserNotParticipantError:
-        if not auto_join:
-            return False, "not_participant"
-        try:
-            client(JoinChannelRequest(target_entity))
-            me = client.get_me()
-            client(GetParticipantRequest(channel=target_entity, participant=me))
-            return True, "joined"
-        except FloodWaitError:
-            return False, "flood_wait"
-        except ChannelPrivateError:
-            return False, "channel_private"
-        except UserBannedInChannelError:
-            return False, "banned_in_channel"
-        except (OSError, ConnectionError):
-            return False, "network"
-        except Exception:
-            return False, "cannot_join"
-    except FloodWaitError:
-        return False, "flood_wait"
-    except ChannelPrivateError:
-        return False, "channel_private"
-    except UserBannedInChannelError:
-        return False, "banned_in_channel"
-    except (OSError, ConnectionError):
-        return False, "network"
-    except RPCError as e:
-        # give caller a hint what exactly happened
-        return False, f"rpc_{e.__class__.__name__}"
-    except Exception:
-        return False, "unknown"
+        pass
+    except Exception as e:
+        return False, _classify_ensure_exc(e)
+
+    if not auto_join:
+        return False, "not_participant"
+    try:
+        await client(JoinChannelRequest(target_entity))
+        # me уже известен — повторный get_me не нужен
+        await client(GetParticipantRequest(channel=target_entity, participant=me))
+        return True, "joined"
+    except Exception as e:
+        return False, _classify_ensure_exc(e, "cannot_join")
+
+
+# сколько сессий preflight проверяет одновременно
+PREFLIGHT_CONCURRENCY = 16
+
+
+def _invite_rights(perms: Any) -> Optional[str]:
+    """Итог get_permissions (результат или исключение): None — права есть/не проверить; иначе no_rights | forbidden | network."""
+    if isinstance(perms, ChatWriteForbiddenError):
+        return "forbidden"
+    if isinstance(perms, (OSError, ConnectionError)):
+        return "network"
+    if isinstance(perms, BaseException):
+        # если не смогли проверить права — оставим как есть
+        return None
+    # если атрибут есть и явно False — значит прав нет
+    return "no_rights" if getattr(perms, "invite_users", None) is False else None
+
+
+async def _preflight_check_async(
+    session_file: str, client: TelegramClient, target: Any, auto_join: bool, sem: asyncio.Semaphore,
+) -> Tuple[bool, str, Optional[str]]:
+    """Сетевая часть preflight одной сессии: (ok, reason, rights).
+
+    rights — None, если права не проверялись/в порядке; иначе no_rights | forbidden | network.
+    Ссылку на цель (str/int) резолвит в этой же сессии, через _TARGET_ENTITIES.
+    Проверка участия и запрос прав идут одновременно; после вступления права запрашиваются заново.
+    """
+    async with sem:
+        target_entity = target
+        if isinstance(target, (str, int)):
+            key = (session_file, target)
+            target_entity = _TARGET_ENTITIES.get(key)
+            if target_entity is None:
+                target_entity = _TARGET_ENTITIES[key] = await client.get_input_entity(target)
+        ensured, perms = await asyncio.gather(
+            _ensure_in_target_async(client, target_entity, auto_join=auto_join),
+            client.get_permissions(target_entity, "me"),
+            return_exceptions=True,
+        )
+        if isinstance(ensured, BaseException):
+            raise ensured
+        ok, reason = ensured
+        if not ok:
+            return ok, reason, None
+        if reason == "joined":
+            # до вступления права не показательны
+            try:
+                perms = await client.get_permissions(target_entity, "me")
+            except Exception as e:
+                perms = e
+        return ok, reason, _invite_rights(perms)
 
 
+@log_batch()
 def preflight_sessions_for_target(
     api_id: int,
     api_hash: str,
@@ -1769,174 +2667,144 @@ def preflight_sessions_for_target(
     conn = _db()
     st_map = session_stats_load(conn, session_files)
 
-    # Resolve target to entity if needed
-    target_entity = target
-    if isinstance(target, str):
-        resolved = None
-        for sf in session_files:
-            try:
-                c = _make_client(sf, api_id, api_hash)
-                resolved = c.get_entity(target)
-                try:
-                    c.disconnect()
-                except Exception:
-                    pass
-                break
-            except Exception:
-                try:
-                    c.disconnect()
-                except Exception:
-                    pass
-                continue
-        if resolved is None:
-            raise RuntimeError("Не удалось резолвить цель для preflight")
-        target_entity = resolved
-
     now = int(time.time())
     block_sec = max(0, int(block_cannot_join_hours)) * 3600
 
+    # сессии, уже наказанные прошлыми прогонами, раскладываем по отчёту без сети:
+    # в ротацию они всё равно не попадут, пока не истечёт блок
+    to_check: List[str] = []
     for sf in session_files:
+        st = st_map.get(sf)
+        if st and st.banned:
+            report["not_authorized"].append(sf)
+            log_warn("⚠️ Preflight: %s — сессия отмечена как неавторизованная (пропуск)", sf)
+        elif st and max(st.blocked_until, st.frozen_until) > now:
+            left = max(st.blocked_until, st.frozen_until) - now
+            bucket = "flood_wait" if st.frozen_until > now or left < 3600 else "cannot_join"
+            report[bucket].append(sf)
+            log_warn("⏳ Preflight: %s — на паузе ещё %s (пропуск)", sf, _fmt_duration(left))
+        else:
+            to_check.append(sf)
+
+    # соединения открываем параллельно (заодно резолвим цель в каждой новой сессии);
+    # авторизация/ошибки создания — как раньше, через пул
+    try:
+        warm_pooled_clients(to_check, api_id, api_hash, target if isinstance(target, (str, int)) else None)
+    except Exception:
+        pass
+
+    checks: List[Tuple[str, Optional[SessionState], TelegramClient]] = []
+    for sf in to_check:
         st = st_map.get(sf)
         try:
-            client = _make_client(sf, api_id, api_hash)
+            client = get_pooled_client(sf, api_id, api_hash)
         except RuntimeError:
             # not authorized
-            if st:
-                st.banned = True
-                st.fail += 1
-                st.attempts += 1
-                st.next_invite_at = max(st.next_invite_at, now + 3600)
-                try:
-                    session_stats_save(conn, st)
-                except Exception:
-                    pass
+            _penalize_unauthorized(st, now)
             report["not_authorized"].append(sf)
-            log_warn(f"⚠️ Preflight: {sf} — сессия не авторизована")
+            log_warn("⚠️ Preflight: %s — сессия не авторизована", sf)
             continue
         except Exception as e:
             report["unknown"].append(sf)
-            log_warn(f"⚠️ Preflight: {sf} — ошибка создания клиента: {e}")
+            log_warn("⚠️ Preflight: %s — ошибка создания клиента: %s", sf, e)
             continue
-
-        try:
-            ok, reason = _ensure_in_target(client, target_entity, auto_join=auto_join)
-            if ok and reason == "ok":
+        checks.append((sf, st, client))
+
+    # сетевые проверки (участие/вступление/права) — одновременно для всех сессий,
+    # результаты разбираем последовательно: report и SQLite трогает только этот поток
+    results: List[Any] = []
+    if checks:
+        sem = asyncio.Semaphore(PREFLIGHT_CONCURRENCY)
+        results = tl_helpers.get_running_loop().run_until_complete(asyncio.gather(
+            *[_preflight_check_async(sf, client, target, auto_join, sem) for sf, _, client in checks],
+            return_exceptions=True,
+        ))
+
+    # ни одна сессия не смогла резолвить цель — как и раньше, preflight прерываем
+    # до разбора результатов, не трогая состояния сессий
+    if checks and isinstance(target, (str, int)) and not any((sf, target) in _TARGET_ENTITIES for sf, _, _ in checks):
+        log_stop("⛔ Preflight: ни одна сессия не смогла резолвить цель %s", target)
+        raise RuntimeError("Не удалось резолвить цель для preflight")
+
+    for (sf, st, client), res in zip(checks, results):
+        if isinstance(res, BaseException):
+            report["unknown"].append(sf)
+            log_warn("⚠️ Preflight: %s — ошибка: %s", sf, res)
+            continue
+        ok, reason, rights = res
+        if ok and rights == "network":
+            # не считаем критичным: просто отметим сеть
+            report["network"].append(sf)
+            log_warn("🌐 Preflight: %s — сетевой сбой при проверке прав", sf)
+            rights = None
+        if ok and rights is None:
+            if reason == "ok":
                 report["ok"].append(sf)
-                log_ok(f"✅ Preflight: {sf} — уже в цели")
-            elif ok and reason == "joined":
+                log_ok("✅ Preflight: %s — уже в цели", sf)
+            else:
                 report["joined"].append(sf)
-                log_ok(f"✅ Preflight: {sf} — вступил в цель")
+                log_ok("✅ Preflight: %s — вступил в цель", sf)
+        elif ok:
+            # в цели, но без прав приглашать — в ротацию не берём
+            report["no_rights"].append(sf)
+            if rights == "no_rights":
+                log_warn("🚫 Preflight: %s — нет прав приглашать (invite_users=False)", sf)
             else:
-                if reason in ("cannot_join", "not_participant", "channel_private", "banned_in_channel"):
-                    report["cannot_join"].append(sf)
-                    if reason == "channel_private":
-                        log_warn(f"⛔ Preflight: {sf} — цель приватная/нет доступа")
-                    elif reason == "banned_in_channel":
-                        log_warn(f"⛔ Preflight: {sf} — аккаунт забанен в цели")
-                    else:
-                        log_warn(f"⛔ Preflight: {sf} — не смог вступить/нет доступа")
-                    if st:
-                        st.blocked_until = max(st.blocked_until, now + (block_sec or 3600))
-                        st.fail += 1
-                        st.attempts += 1
-                        try:
-                            session_stats_save(conn, st)
-                        except Exception:
-                            pass
-                elif reason == "flood_wait":
-                    report["flood_wait"].append(sf)
-                    log_warn(f"⏳ Preflight: {sf} — FloodWait (пауза)")
-                    if st:
-                        # минимально на 10 минут, дальше уже inviter поймает точное время
-                        st.blocked_until = max(st.blocked_until, now + 600)
-                        st.fail += 1
-                        st.attempts += 1
-                        try:
-                            session_stats_save(conn, st)
-                        except Exception:
-                            pass
-                elif reason == "network":
-                    report["network"].append(sf)
-                    log_warn(f"🌐 Preflight: {sf} — сетевой сбой (пропуск)")
-                    if st:
-                        st.blocked_until = max(st.blocked_until, now + 120)
-                        st.fail += 1
-                        st.attempts += 1
-                        try:
-                            session_stats_save(conn, st)
-                        except Exception:
-                            pass
-                else:
-                    report["unknown"].append(sf)
-                    if isinstance(reason, str) and reason.startswith("rpc_"):
-                        log_warn(f"⚠️ Preflight: {sf} — RPC ошибка при проверке: {reason}")
-                    else:
-                        log_warn(f"⚠️ Preflight: {sf} — неизвестная ошибка проверки: {reason}")
-
-            # Если мы в цели — дополнительно проверим права приглашать
-            if (sf in report["ok"] or sf in report["joined"]):
-                try:
-                    perms = client.get_permissions(target_entity, "me")
-                    invite_flag = getattr(perms, "invite_users", None)
-                    # если атрибут есть и явно False — значит прав нет
-                    if invite_flag is False:
-                        report["no_rights"].append(sf)
-                        # выкинем из ok/joined чтобы не бралась в ротацию
-                        if sf in report["ok"]:
-                            report["ok"].remove(sf)
-                        if sf in report["joined"]:
-                            report["joined"].remove(sf)
-                        log_warn(f"🚫 Preflight: {sf} — нет прав приглашать (invite_users=False)")
-                        if st:
-                            st.blocked_until = max(st.blocked_until, now + 86400)
-                            st.fail += 1
-                            st.attempts += 1
-                            try:
-                                session_stats_save(conn, st)
-                            except Exception:
-                                pass
-                except ChatWriteForbiddenError:
-                    report["no_rights"].append(sf)
-                    if sf in report["ok"]:
-                        report["ok"].remove(sf)
-                    if sf in report["joined"]:
-                        report["joined"].remove(sf)
-                    log_warn(f"🚫 Preflight: {sf} — ChatWriteForbidden (нет прав/ограничен)")
-                    if st:
-                        st.blocked_until = max(st.blocked_until, now + 86400)
-                        st.fail += 1
-                        st.attempts += 1
-                        try:
-                            session_stats_save(conn, st)
-                        except Exception:
-                            pass
-                except (OSError, ConnectionError):
-                    # не считаем критичным: просто отметим сеть
-                    if sf not in report["network"]:
-                        report["network"].append(sf)
-                    log_warn(f"🌐 Preflight: {sf} — сетевой сбой при проверке прав")
-                except Exception:
-                    # если не смогли проверить права — оставим как есть
-                    pass
-        except Exception as e:
+                log_warn("🚫 Preflight: %s — ChatWriteForbidden (нет прав/ограничен)", sf)
+            _penalize(st, now + 86400)
+        elif reason in ("cannot_join", "not_participant", "channel_private", "banned_in_channel"):
+            report["cannot_join"].append(sf)
+            if reason == "channel_private":
+                log_warn("⛔ Preflight: %s — цель приватная/нет доступа", sf)
+            elif reason == "banned_in_channel":
+                log_warn("⛔ Preflight: %s — аккаунт забанен в цели", sf)
+            else:
+                log_warn("⛔ Preflight: %s — не смог вступить/нет доступа", sf)
+            _penalize(st, now + (block_sec or 3600))
+        elif reason == "not_authorized":
+            # ключ авторизации отозван/аккаунт удалён — как при неудачном создании клиента
+            report["not_authorized"].append(sf)
+            log_warn("⚠️ Preflight: %s — сессия не авторизована", sf)
+            drop_pooled_client(sf)
+            _penalize_unauthorized(st, now)
+        elif reason == "flood_wait":
+            report["flood_wait"].append(sf)
+            log_warn("⏳ Preflight: %s — FloodWait (пауза)", sf)
+            # минимально на 10 минут, дальше уже inviter поймает точное время
+            _penalize(st, now + 600)
+        elif reason == "network":
+            report["network"].append(sf)
+            log_warn("🌐 Preflight: %s — сетевой сбой (пропуск)", sf)
+            _penalize(st, now + 120)
+        else:
             report["unknown"].append(sf)
-            log_warn(f"⚠️ Preflight: {sf} — ошибка: {e}")
-        finally:
-            try:
-                client.disconnect()
-            except Exception:
-                pass
+            if isinstance(reason, str) and reason.startswith("rpc_"):
+                log_warn("⚠️ Preflight: %s — RPC ошибка при проверке: %s", sf, reason)
+            else:
+                log_warn("⚠️ Preflight: %s — неизвестная ошибка проверки: %s", sf, reason)
+        # клиент остаётся в пуле: следующий за preflight инвайт подхватит готовое соединение
+
+    # все изменения состояний сессий — одной транзакцией, а не commit на каждую
+    try:
+        invite_state_flush(conn, st_map.values())
+    except Exception:
+        pass
 
     return report
 # -------------------------------------------------------------------
 # (Опционально) экспортируем публичные функции для удобного импорта
 __all__ = [
     "config",
+    "Options",
     "getoptions",
+    "saveoptions",
     "parsing",
     "parsing_from_messages",
     "inviting",
     "inviting_rotate_sessions",
     "preflight_sessions_for_target",
     "target_ref",
+    "get_pooled_client",
+    "clear_screen",
+    "ui_pause",
 ]
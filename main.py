@@ -10,11 +10,15 @@ telegram-parser-v2.3 (main)
 - app.log
 """
 
-import os
+import itertools
+import mmap
+import re
 import time
-from typing import List, Optional, Union
+import weakref
+from typing import Iterator, List, Optional, Tuple, Union
 
 from telethon.sync import TelegramClient
+from telethon.tl.types import Channel, ChannelForbidden, Chat, ChatForbidden
 
 from defunc import (
     config,
@@ -28,8 +32,10 @@ from defunc import (
     prune_users_files,
     SESSIONS_DIR,
     ensure_sessions_dir,
+    get_pooled_client,
     list_session_files,
-    session_name_from_file,
+    ui_pause,
+    clear_screen,
 )
 
 
@@ -38,16 +44,23 @@ def yn(prompt: str) -> bool:
     return raw in ("y", "yes", "д", "да")
 
 
+# тип entity -> подпись в списке диалогов; None — решает флаг broadcast
+# (супергруппа — тоже Channel, но без broadcast)
+_DIALOG_KINDS = {
+    Channel: None,
+    ChannelForbidden: None,
+    Chat: "Группа",
+    ChatForbidden: "Группа",
+}
+
+
 def _fmt_dialog(d) -> str:
     ent = d.entity
     username = getattr(ent, "username", None)
     did = getattr(ent, "id", None)
-    kind = "Чат"
-    cls = ent.__class__.__name__.lower()
-    if "channel" in cls:
-        kind = "Канал"
-    if "chat" in cls and "channel" not in cls:
-        kind = "Группа"
+    kind = _DIALOG_KINDS.get(type(ent), "Чат")
+    if kind is None:
+        kind = "Канал" if ent.broadcast else "Группа"
     name = (d.name or "").strip() or "(без названия)"
     if username:
         return f"{kind}: {name}  (@{username})"
@@ -56,26 +69,80 @@ def _fmt_dialog(d) -> str:
     return f"{kind}: {name}"
 
 
+# сколько диалогов показывать в выборе и среди скольких последних искать по фильтру
+DIALOGS_SHOW_LIMIT = 50
+DIALOGS_SCAN_LIMIT = 200
+# первая страница: один запрос GetDialogs отдаёт не больше 100 диалогов
+DIALOGS_PAGE = 100
+
+# список диалогов по клиенту (клиенты живут в пуле): client -> (когда получен, диалоги, сколько запрашивали).
+# Парсинг и следующий за ним инвайт той же сессией не ходят за диалогами повторно.
+DIALOGS_CACHE_TTL = 60.0
+_dialogs_cache: "weakref.WeakKeyDictionary[TelegramClient, Tuple[float, list, int]]" = weakref.WeakKeyDictionary()
+
+
+def _cached_dialogs(client: TelegramClient, need: int) -> Optional[list]:
+    """Свежие диалоги из кэша, если их хватает на need (или диалогов меньше, чем запрашивали)."""
+    hit = _dialogs_cache.get(client)
+    if hit is None:
+        return None
+    ts, dialogs, limit = hit
+    if time.monotonic() - ts > DIALOGS_CACHE_TTL:
+        return None
+    if limit < need and len(dialogs) >= limit:
+        return None
+    return dialogs[:need]
+
+
+def _iter_more_dialogs(client: TelegramClient, last, limit: int):
+    """Диалоги после last (продолжение уже полученной страницы), не больше limit."""
+    msg_id = last.message.id if last.message is not None else 0
+    return client.iter_dialogs(limit=limit, offset_date=last.date, offset_id=msg_id, offset_peer=last.input_entity)
+
+
 def pick_dialog(client: TelegramClient, title: str):
     """Показывает список диалогов и возвращает entity (предпочтительно) либо введённую строку."""
-    try:
-        dialogs = client.get_dialogs(limit=200)
-    except Exception:
-        dialogs = []
+    # сначала одна страница последних диалогов: если её не получить, фильтр не спрашиваем
+    dialogs = _cached_dialogs(client, DIALOGS_PAGE)
+    if dialogs is None:
+        try:
+            dialogs = list(client.get_dialogs(limit=DIALOGS_PAGE))
+        except Exception:
+            dialogs = []
+        if dialogs:
+            _dialogs_cache[client] = (time.monotonic(), dialogs, DIALOGS_PAGE)
 
     if not dialogs:
         print("Не удалось получить список диалогов. Вставь @username/ссылку/id вручную.")
         return input(title).strip() or None
 
-    flt = input("Фильтр (часть названия) или Enter чтобы показать последние 50: ").strip().lower()
-    if flt:
-        dialogs = [d for d in dialogs if flt in (d.name or "").lower()]
-
-    dialogs = dialogs[:50]
-    print("\n=== ТВОИ ДИАЛОГИ (последние/по фильтру) ===")
-    for i, d in enumerate(dialogs, 1):
-        print(f"{i}. {_fmt_dialog(d)}")
-    print("0. Ввести вручную")
+    flt = input("Фильтр (часть названия) или Enter чтобы показать последние 50: ").strip().casefold()
+    if not flt:
+        dialogs = dialogs[:DIALOGS_SHOW_LIMIT]
+    else:
+        # фильтруем уже полученную страницу; следующие (до DIALOGS_SCAN_LIMIT) подкачиваются,
+        # только если совпадений не набралось, а страница была полной
+        source = _cached_dialogs(client, DIALOGS_SCAN_LIMIT)
+        if source is None:
+            source = dialogs
+            if len(dialogs) >= DIALOGS_PAGE:
+                source = itertools.chain(dialogs, _iter_more_dialogs(client, dialogs[-1], DIALOGS_SCAN_LIMIT - len(dialogs)))
+        try:
+            # islice останавливает и фильтр, и подкачку страниц на 50-м совпадении
+            dialogs = list(itertools.islice(
+                (d for d in source if flt in (d.name or "").casefold()),
+                DIALOGS_SHOW_LIMIT,
+            ))
+        except Exception:
+            print("Не удалось получить список диалогов. Вставь @username/ссылку/id вручную.")
+            return input(title).strip() or None
+
+    # весь список — одной записью в stdout, а не print на каждую строку
+    print("\n".join([
+        "\n=== ТВОИ ДИАЛОГИ (последние/по фильтру) ===",
+        *(f"{i}. {_fmt_dialog(d)}" for i, d in enumerate(dialogs, 1)),
+        "0. Ввести вручную",
+    ]))
     raw = input("Выбор: ").strip()
     if raw == "0":
         return input(title).strip() or None
@@ -89,24 +156,22 @@ def pick_dialog(client: TelegramClient, title: str):
     return dialogs[idx - 1].entity
 
 
-def clear() -> None:
-    os.system("cls||clear")
-
-
 def list_sessions() -> List[str]:
     return list_session_files()
 
 
+def _print_sessions(sessions: List[str]) -> None:
+    print("\n".join(["=== АККАУНТЫ (.session) ===", *(f"{i}. {s}" for i, s in enumerate(sessions, 1))]))
+
+
 def pick_session() -> Optional[str]:
     sessions = list_sessions()
     if not sessions:
         print("Сессии не найдены. Зайди в Настройки → Добавить аккаунт.")
-        time.sleep(2)
+        ui_pause(2)
         return None
 
-    print("=== АККАУНТЫ (.session) ===")
-    for i, s in enumerate(sessions, 1):
-        print(f"{i}. {s}")
+    _print_sessions(sessions)
     raw = input("Выбери номер аккаунта: ").strip()
     if not raw.isdigit():
         return None
@@ -127,12 +192,10 @@ def pick_sessions() -> List[str]:
     sessions = list_sessions()
     if not sessions:
         print("Сессии не найдены. Зайди в Настройки → Добавить аккаунт.")
-        time.sleep(2)
+        ui_pause(2)
         return []
 
-    print("=== АККАУНТЫ (.session) ===")
-    for i, s in enumerate(sessions, 1):
-        print(f"{i}. {s}")
+    _print_sessions(sessions)
 
     raw = input("Выбери аккаунты (all или номера через запятую): ").strip().lower()
     if not raw:
@@ -149,114 +212,125 @@ def pick_sessions() -> List[str]:
         if 1 <= idx <= len(sessions):
             out.append(sessions[idx - 1])
 
-    seen = set()
-    uniq: List[str] = []
-    for s in out:
-        if s in seen:
-            continue
-        seen.add(s)
-        uniq.append(s)
-    return uniq
+    # без повторов, в порядке ввода
+    return list(dict.fromkeys(out))
 
 
 def make_client(session_file: str, api_id: int, api_hash: str) -> TelegramClient:
-    # session_file хранится как '<name>.session' (basename), а сами файлы лежат в папке sessoins/
-    session_name = session_name_from_file(session_file)
-    client = TelegramClient(session_name, api_id, api_hash)
-    client.connect()
-    if not client.is_user_authorized():
+    # клиент из общего пула defunc: между пунктами меню соединение не рвётся,
+    # повторный парсинг/инвайт той же сессией обходится без нового connect/handshake.
+    # Пул закрывается при выходе из программы (atexit).
+    try:
+        return get_pooled_client(session_file, api_id, api_hash)
+    except RuntimeError:
         print(f"Сессия не авторизована. Создай её заново в Настройках (пункт 5). Папка: {SESSIONS_DIR}/")
         raise SystemExit(1)
-    return client
 
 
 def do_parsing() -> None:
-    clear()
+    clear_screen()
     opts = getoptions()
-    if opts[0].strip() in ("NONEID", "") or opts[1].strip() in ("NONEHASH", ""):
+    if not opts.has_api:
         print("Сначала задай API_ID и API_HASH в Настройках.")
-        time.sleep(2)
+        ui_pause(2)
         return
 
     sess = pick_session()
     if not sess:
         return
 
-    api_id = int(opts[0].strip())
-    api_hash = opts[1].strip()
+    api_id = opts.api_id
+    api_hash = opts.api_hash
 
-    parse_id = (opts[2].strip() == "True")
-    parse_name = (opts[3].strip() == "True")
+    parse_id = opts.parse_id
+    parse_name = opts.parse_name
 
     client = make_client(sess, api_id, api_hash)
     src = pick_dialog(client, "Источник (чат/канал) для парсинга (@username/ссылка/id): ")
     if not src:
-        client.disconnect()
         return
     try:
         parsing(client, src, parse_id=parse_id, parse_name=parse_name)
         print("Готово. Смотри usernames.txt / userids.txt и app.log")
     finally:
-        client.disconnect()
-        time.sleep(1.5)
-
-
-def _load_users_from_files() -> List[Union[str, int]]:
-    users: List[Union[str, int]] = []
-    if os.path.exists("userids.txt"):
-        with open("userids.txt", "r", encoding="utf-8") as f:
-            for line in f:
-                s = line.strip()
-                if s.isdigit():
-                    users.append(int(s))
-    if os.path.exists("usernames.txt"):
-        with open("usernames.txt", "r", encoding="utf-8") as f:
-            for line in f:
-                s = line.strip()
-                if not s:
-                    continue
-                if s.startswith("@"):
-                    s = s[1:]
-                if s:
-                    users.append(s)
-
-    seen = set()
-    uniq = []
-    for u in users:
-        k = ("id", u) if isinstance(u, int) else ("u", u.lower())
-        if k in seen:
-            continue
-        seen.add(k)
-        uniq.append(u)
-    return uniq
+        ui_pause(1.5)
+
+
+# строки списков разбирает regex прямо по отображённому в память файлу (mmap):
+# без построчного read/decode, совпадения идут лениво по мере чтения
+_USER_ID_RE = re.compile(rb"(?m)^[ \t]*(\d+)[ \t\r]*$")
+_USERNAME_RE = re.compile(rb"(?m)^[ \t]*@?([^\r\n]*?)[ \t\r]*$")
+
+
+def _map_file(path: str) -> Optional[mmap.mmap]:
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        # пустой файл не отображается
+        return None
+    # просим ядро сразу подтянуть файл в page cache в фоне (Linux/BSD)
+    if hasattr(mmap, "MADV_WILLNEED"):
+        try:
+            mm.madvise(mmap.MADV_WILLNEED)
+        except OSError:
+            pass
+    return mm
+
+
+def _iter_users_from_files() -> Iterator[Union[str, int]]:
+    """Пользователи из userids.txt и usernames.txt потоком (порядок как в файлах)."""
+    # оба файла отображаем заранее: чтение usernames.txt с диска идёт, пока разбирается userids.txt
+    ids_mm = _map_file("userids.txt")
+    names_mm = _map_file("usernames.txt")
+    try:
+        yield from _iter_users(ids_mm, names_mm)
+    finally:
+        for mm in (ids_mm, names_mm):
+            if mm is not None:
+                mm.close()
+
+
+def _iter_users(ids_mm: Optional[mmap.mmap], names_mm: Optional[mmap.mmap]) -> Iterator[Union[str, int]]:
+    # повторы здесь не отсекаем: дедуп один — в _iter_candidates инвайтера, по интернированным
+    # ключам parse_user_ref (второй набор ключей тут только удвоил бы память на больших списках)
+    if ids_mm is not None:
+        for m in _USER_ID_RE.finditer(ids_mm):
+            yield int(m.group(1))
+    if names_mm is not None:
+        for m in _USERNAME_RE.finditer(names_mm):
+            s = m.group(1)
+            if s:
+                yield s.decode("utf-8", "replace")
 
 
 def do_parsing_messages() -> None:
-    clear()
+    clear_screen()
     opts = getoptions()
-    if opts[0].strip() in ("NONEID", "") or opts[1].strip() in ("NONEHASH", ""):
+    if not opts.has_api:
         print("Сначала задай API_ID и API_HASH в Настройках.")
-        time.sleep(2)
+        ui_pause(2)
         return
 
     sess = pick_session()
     if not sess:
         return
 
-    api_id = int(opts[0].strip())
-    api_hash = opts[1].strip()
+    api_id = opts.api_id
+    api_hash = opts.api_hash
 
     client = make_client(sess, api_id, api_hash)
     src = pick_dialog(client, "Источник (чат/канал/группа): ")
     if not src:
-        client.disconnect()
         return
 
     parse_name = yn("Парсить usernames? (y/n): ")
     parse_id = yn("Парсить user ids? (y/n): ")
     if not (parse_name or parse_id):
         print("Нечего парсить — выбери хотя бы usernames или ids.")
-        time.sleep(2)
+        ui_pause(2)
         return
 
     lm_raw = input("Сколько сообщений смотреть? (по умолчанию 5000): ").strip()
@@ -281,40 +355,41 @@ def do_parsing_messages() -> None:
         )
         print("Готово. Смотри usernames.txt / userids.txt и app.log")
     finally:
-        client.disconnect()
-        time.sleep(1.5)
+        ui_pause(1.5)
 
 
 def do_inviting() -> None:
-    clear()
+    clear_screen()
     opts = getoptions()
-    if opts[0].strip() in ("NONEID", "") or opts[1].strip() in ("NONEHASH", ""):
+    if not opts.has_api:
         print("Сначала задай API_ID и API_HASH в Настройках.")
-        time.sleep(2)
+        ui_pause(2)
         return
 
     sess_list = pick_sessions()
     if not sess_list:
         return
 
-    api_id = int(opts[0].strip())
-    api_hash = opts[1].strip()
+    api_id = opts.api_id
+    api_hash = opts.api_hash
 
     # Берём первую сессию, чтобы выбрать цель из диалогов
     client = make_client(sess_list[0], api_id, api_hash)
     target_entity = pick_dialog(client, "Куда инвайтить? (@username/ссылка/id): ")
     if not target_entity:
-        client.disconnect()
         return
 
     # Важно: делаем target переносимым между сессиями
     target = target_ref(target_entity)
 
-    users = _load_users_from_files()
-    if not users:
+    users_iter = _iter_users_from_files()
+    first = next(users_iter, None)
+    if first is None:
         print("Списки пустые. Сначала сделай Парсинг.")
-        time.sleep(2)
+        ui_pause(2)
         return
+    # инвайтер проходит список один раз — отдаём поток, не собирая его в память
+    users = itertools.chain((first,), users_iter)
 
     raw_delay = input("Базовая задержка между попытками (сек), по умолчанию 2.0: ").strip()
     try:
@@ -325,13 +400,14 @@ def do_inviting() -> None:
     try:
         if len(sess_list) == 1:
             inviting(client, target_entity, users, base_delay=base_delay)
+            # инвайт мог остановиться раньше конца списка: отпускаем mmap до prune (Windows не заменит отображённый файл)
+            users_iter.close()
             if yn("Очистить usernames.txt / userids.txt от уже обработанных (ускорить следующий прогон)? (y/n): "):
                 removed, kept = prune_users_files(target)
                 print(f"Очищено записей: {removed}. Осталось: {kept}. Бэкап: *.bak-...")
                 input("Нажми Enter...")
         else:
-            # закрываем первый клиент, дальше будут открываться по мере ротации
-            client.disconnect()
+            # первый клиент остаётся в пуле — ротация подхватит его без переподключения
 
             re_raw = input(
                 "Плановая смена сессии каждые N успешных инвайтов (0 = только по флуду), по умолчанию 0: "
@@ -367,12 +443,6 @@ def do_inviting() -> None:
                 night_start = _parse_hm(ns, (2,0))
                 night_end = _parse_hm(ne, (7,0))
 
-            ua_raw = input("Лимит попыток на одного юзера за прогон (по умолчанию 3): ").strip()
-            try:
-                max_user_attempts = int(ua_raw) if ua_raw else 3
-            except Exception:
-                max_user_attempts = 3
-
             pf_raw = input("Заморозка сессии при PeerFlood (часы, по умолчанию 24): ").strip()
             try:
                 peerflood_hours = int(pf_raw) if pf_raw else 24
@@ -438,7 +508,6 @@ def do_inviting() -> None:
                 max_attempts_per_session=max_attempts,
                 jitter_min=jitter_min,
                 jitter_max=jitter_max,
-                max_user_attempts=max_user_attempts,
                 peerflood_freeze_hours=peerflood_hours,
                 night_mode=nm,
                 night_start=night_start,
@@ -446,6 +515,7 @@ def do_inviting() -> None:
                 per_hour_limit=per_hour,
                 per_day_limit=per_day,
             )
+            users_iter.close()
 
             # Опциональная очистка базы: убираем уже обработанных из файлов
             if yn("Очистить usernames.txt / userids.txt от уже обработанных (ускорить следующий прогон)? (y/n): "):
@@ -454,16 +524,22 @@ def do_inviting() -> None:
                 input("Нажми Enter...")
         print("Готово. Смотри invite_ledger.db и app.log")
     finally:
-        try:
-            client.disconnect()
-        except Exception:
-            pass
-        time.sleep(1.5)
+        users_iter.close()
+        ui_pause(1.5)
+
+
+# пункт главного меню -> обработчик (как _CONFIG_ACTIONS в defunc)
+_MENU = {
+    "1": config,
+    "2": do_parsing,
+    "3": do_parsing_messages,
+    "4": do_inviting,
+}
 
 
 def main() -> None:
     while True:
-        clear()
+        clear_screen()
         print("=== TELEGRAM PARSER / INVITER v2.3 ===")
         print("1 - Настройки")
         print("2 - Парсинг участников (если список виден)")
@@ -472,19 +548,14 @@ def main() -> None:
         print("5 - Выход")
         key = input("Ввод: ").strip()
 
-        if key == "1":
-            config()
-        elif key == "2":
-            do_parsing()
-        elif key == "3":
-            do_parsing_messages()
-        elif key == "4":
-            do_inviting()
-        elif key == "5":
+        if key == "5":
             break
-        else:
+        action = _MENU.get(key)
+        if action is None:
             print("Неверный пункт.")
-            time.sleep(1)
+            ui_pause(1)
+            continue
+        action()
 
 
 if __name__ == "__main__":